@@ -4,7 +4,7 @@ import logging as log
 from argparse import ArgumentParser
 
 from icarus.analyze.exposure.exposure import Exposure
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import open_database
 from icarus.util.config import ConfigUtil
 
 parser = ArgumentParser()
@@ -32,7 +32,7 @@ config = ConfigUtil.load_config(path('config.json'))
 log.info('Running daymet exposure analysis tool.')
 log.info(f'Loading run data from {home}.')
 
-database = SqliteUtil(path('database.db'))
+database = open_database(home, 'exposure')
 exposure = Exposure(database)
 
 if not exposure.ready():
@@ -46,7 +46,8 @@ elif exposure.complete():
 
 try:
     log.info('Starting exposure analysis.')
-    exposure.analyze(args.source)
+    with database.bulk_load():
+        exposure.analyze(args.source)
 except:
     log.exception('Critical error while analyzing exposure; '
         'terminating process and exiting.')
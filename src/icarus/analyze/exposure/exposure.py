@@ -5,13 +5,16 @@ from icarus.analyze.exposure.network import Network
 from icarus.analyze.exposure.population import Population
 from icarus.util.general import bins
 from icarus.util.sqlite import SqliteUtil
+from icarus.util.indexes import create_indexes
 
 
 class Exposure:
     def __init__(self, database: SqliteUtil):
         self.database = database
         self.network = Network(database)
-        self.population = Population(database, self.network)
+        # readers only see committed data alongside a writer in wal mode
+        self.pool = database.pool() if database.wal else None
+        self.population = Population(database, self.network, self.pool)
     
 
     def fetch_agents(self):
@@ -50,25 +53,6 @@ class Exposure:
         self.database.connection.commit()
 
     
-    def create_indexes(self):
-        query = '''
-            CREATE INDEX output_agents_agent 
-            ON output_agents(agent_id);
-        '''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_activities_agent
-            ON output_activities(agent_id, agent_idx);
-        '''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_legs_agent 
-            ON output_legs(agent_id, agent_idx);
-        '''
-        self.database.cursor.execute(query)
-        self.database.connection.commit()
-
-
     def verify_tables(self):
         original_count = (
             self.database.count_rows('output_agents'),
@@ -175,4 +159,8 @@ class Exposure:
 
 
         log.info('Creating indexes on new tables.')
-        self.create_indexes()
+        create_indexes(self.database, 'output_agents', 'output_activities',
+            'output_legs', 'output_events')
+
+        if self.pool is not None:
+            self.pool.close()
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import os
+import numpy as np
 import logging as log
 from typing import List, Set, Dict
 
@@ -12,11 +13,8 @@ from icarus.analyze.exposure.parcel import Parcel
 from icarus.analyze.exposure.types import NetworkMode
 from icarus.analyze.exposure.temperature import Temperature
 from icarus.util.sqlite import SqliteUtil
-from icarus.util.general import counter, defaultdict
-
-
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
+from icarus.util.snapshot import load_snapshot
+from icarus.util.general import counter
 
 
 class Network:
@@ -32,6 +30,26 @@ class Network:
         self.parcels: Dict[str, Parcel] = {}
 
 
+    def fetch_temperatures(self, query: str, name: str) \
+            -> Dict[int, Temperature]:
+        batches = self.database.fetch_batches(query, 
+            dtypes=(np.int64, np.int64, object))
+        batches = counter(batches, f'Loading {name} temperature batch %s.')
+        batches = list(batches)
+        if not len(batches):
+            return {}
+        ids = np.concatenate([batch.temperature_id for batch in batches])
+        idxs = np.concatenate([batch.temperature_idx for batch in batches])
+        values = np.concatenate([batch.temperature for batch in batches])
+
+        uuids, rows = np.unique(ids, return_inverse=True)
+        temps = np.full((len(uuids), 96), None, dtype=object)
+        temps[rows, idxs] = values
+
+        return {uuid: Temperature(uuid, values) for uuid, values 
+            in zip(uuids.tolist(), temps.tolist())}
+
+
     def load_temperatures(self, kind: str = 'mrt'):
         log.info('Loading network air temperature data.')
         query = '''
@@ -41,33 +59,17 @@ class Network:
                 temperature
             FROM air_temperatures;
         '''
-        self.database.cursor.execute(query)
-        rows = self.database.fetch_rows()
-
-        temps = defaultdict(lambda: [None]*96)
-        rows = counter(rows, 'Loading air temperature %s.')
-        for temperature_id, temperature_idx, temperature in rows:
-            temps[temperature_id][temperature_idx] = temperature
-        for uuid, values in temps.items():
-            self.air_temperatures[uuid] = Temperature(uuid, values)
+        self.air_temperatures = self.fetch_temperatures(query, 'air')
 
         log.info('Loading network mrt temperature data.')
         query = f'''
             SELECT
                 temperature_id,
                 temperature_idx,
-                {kind}
+                {kind} AS temperature
             FROM mrt_temperatures;
         '''
-        self.database.cursor.execute(query)
-        rows = self.database.cursor.fetchall()
-
-        temps = defaultdict(lambda: [None]*96)
-        rows = counter(rows, 'Loading mrt temperature %s.')
-        for temperature_id, temperature_idx, temperature in rows:
-            temps[temperature_id][temperature_idx] = temperature
-        for uuid, values in temps.items():
-            self.mrt_temperatures[uuid] = Temperature(uuid, values)
+        self.mrt_temperatures = self.fetch_temperatures(query, 'mrt')
 
 
     # def load_nodes(self):
@@ -75,45 +77,40 @@ class Network:
     #         SELECT
     #             node_id,
     #             maz,
-    #             point
+    #             x,
+    #             y
     #         FROM nodes;
     #     '''
     #     self.database.cursor.execute(query)
     #     result = self.database.cursor.fetchall()
 
     #     nodes = counter(result, 'Loading node %s.')
-    #     for node_id, maz, point in nodes:
-    #         x, y = xy(point)
+    #     for node_id, maz, x, y in nodes:
     #         self.nodes[node_id] = Node(node_id, maz, x, y)
 
 
     def load_links(self):
         log.info('Loading network road link data.')
-        query = '''
-            SELECT
-                link_id,
-                length,
-                freespeed,
-                modes,
-                air_temperature,
-                mrt_temperature
-            FROM links; 
-        '''
-        self.database.cursor.execute(query)
-        result = self.database.cursor.fetchall()
-
-        links = counter(result, 'Loading link %s.')
-        for link_id, length, speed, modes, air_temp, mrt_temp in links:
-            modes_set = set(NetworkMode(mode) for mode in modes.split(','))
+        network = load_snapshot(self.database)
+        modes = {}
+        rows = zip(network.link_ids.tolist(), network.link_length.tolist(),
+            network.link_freespeed.tolist(), network.link_modes.tolist(),
+            network.link_air.tolist(), network.link_mrt.tolist())
+
+        links = counter(rows, 'Loading link %s.')
+        for link_id, length, speed, mask, air_temp, mrt_temp in links:
+            if mask not in modes:
+                modes[mask] = set(NetworkMode(mode) 
+                    for mode in network.decode_modes(mask))
             air_temperature = self.air_temperatures[air_temp]
             mrt_temperature = None
-            if mrt_temp is not None:
+            if mrt_temp >= 0:
                 mrt_temperature = self.mrt_temperatures[mrt_temp]
             link = Link(
                 link_id,
                 length, 
                 speed, 
-                modes_set,
+                modes[mask],
                 air_temperature,
                 mrt_temperature
             )
@@ -9,18 +9,21 @@ from icarus.analyze.exposure.activity import Activity
 from icarus.analyze.exposure.types import LegMode, ActivityType
 from icarus.analyze.exposure.agent import Agent
 from icarus.util.general import defaultdict
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, SqlitePool
 
 
 class Population:
-    def __init__(self, database: SqliteUtil, network: Network):
+    def __init__(self, database: SqliteUtil, network: Network, 
+            pool: SqlitePool = None):
         self.database = database
+        self.pool = pool
         self.network  = network
         self.agents: Dict[str, Agent] = {}
         self.table = None
 
 
-    def fetch_events(self):
+    def fetch_events(self, database: SqliteUtil = None):
+        database = self.database if database is None else database
         query = f'''
             SELECT
                 output_events.event_id,
@@ -38,11 +41,12 @@ class Population:
                 leg_id,
                 leg_idx;
         '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
+        database.cursor.execute(query)
+        return database.cursor.fetchall()
 
     
-    def fetch_legs(self):
+    def fetch_legs(self, database: SqliteUtil = None):
+        database = self.database if database is None else database
         query = f'''
             SELECT
                 leg_id,
@@ -55,11 +59,12 @@ class Population:
             INNER JOIN {self.table}
             USING(agent_id);
         '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
+        database.cursor.execute(query)
+        return database.cursor.fetchall()
 
 
-    def fetch_activities(self):
+    def fetch_activities(self, database: SqliteUtil = None):
+        database = self.database if database is None else database
         query = f'''
             SELECT
                 output_activities.activity_id,
@@ -76,38 +81,42 @@ class Population:
             INNER JOIN activities
             USING(activity_id);
         '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
+        database.cursor.execute(query)
+        return database.cursor.fetchall()
 
     
-    def fetch_agents(self):
+    def fetch_agents(self, database: SqliteUtil = None):
+        database = self.database if database is None else database
         query = f'''
             SELECT agent_id
             FROM output_agents
             INNER JOIN {self.table}
             USING(agent_id);
         '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
+        database.cursor.execute(query)
+        return database.cursor.fetchall()
 
     
-    def load_events(self):
-        events = self.fetch_events()
+    def load_events(self, events: List[tuple] = None):
+        if events is None:
+            events = self.fetch_events()
         for event_id, agent_id, agent_idx, link_id, start, end in events:
             link = self.network.links[link_id]
             event = Event(event_id, link, start, end)
             self.agents[agent_id].add_event(agent_idx, event)
 
     
-    def load_legs(self):
-        legs = self.fetch_legs()
+    def load_legs(self, legs: List[tuple] = None):
+        if legs is None:
+            legs = self.fetch_legs()
         for leg_id, agent_id, _, mode, start, end in legs:
             leg = Leg(leg_id, LegMode(mode), start, end)
             self.agents[agent_id].add_leg(leg)
 
     
-    def load_activities(self):
-        activities = self.fetch_activities()
+    def load_activities(self, activities: List[tuple] = None):
+        if activities is None:
+            activities = self.fetch_activities()
         for activity_id, agent_id, _, kind, link_id, start, end, apn in activities:
             parcel = self.network.parcels[apn]
             link = self.network.links[link_id]
@@ -116,8 +125,10 @@ class Population:
             self.agents[agent_id].add_activity(activity)
 
 
-    def load_agents(self):
-        agents = tuple(agent[0] for agent in self.fetch_agents())
+    def load_agents(self, agents: List[tuple] = None):
+        if agents is None:
+            agents = self.fetch_agents()
+        agents = tuple(agent[0] for agent in agents)
         for agent_id in agents:
             self.agents[agent_id] = Agent(agent_id)
 
@@ -141,10 +152,20 @@ class Population:
 
     
     def load_population(self):
-        self.load_agents()
-        self.load_activities()
-        self.load_legs()
-        self.load_events()
+        if self.pool is None:
+            self.load_agents()
+            self.load_activities()
+            self.load_legs()
+            self.load_events()
+        else:
+            fetches = (self.fetch_agents, self.fetch_activities, 
+                self.fetch_legs, self.fetch_events)
+            agents, activities, legs, events = self.pool.map(
+                lambda reader, fetch: fetch(reader), fetches)
+            self.load_agents(agents)
+            self.load_activities(activities)
+            self.load_legs(legs)
+            self.load_events(events)
 
     
     def delete_population(self):
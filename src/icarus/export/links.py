@@ -8,11 +8,7 @@ from argparse import ArgumentParser
 from pyproj.transformer import Transformer
 
 from icarus.util.general import counter
-from icarus.util.sqlite import SqliteUtil
-
-
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
+from icarus.util.sqlite import SqliteUtil, open_database
 
 
 def get_wkt_string(epsg: int) -> str:
@@ -52,17 +48,18 @@ def export_links(database: SqliteUtil, filepath: str, src_epsg: int,
             links.modes,
             links.air_temperature,
             links.mrt_temperature,
-            nodes1.point,
-            nodes2.point
+            nodes1.x AS source_x,
+            nodes1.y AS source_y,
+            nodes2.x AS terminal_x,
+            nodes2.y AS terminal_y
         FROM links
         INNER JOIN nodes AS nodes1
         ON links.source_node = nodes1.node_id
         INNER JOIN nodes AS nodes2
         ON links.terminal_node = nodes2.node_id;
     '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
-    rows = counter(rows, 'Exporting link %s.')
+    batches = database.fetch_batches(query, batch_size=100000)
+    batches = counter(batches, 'Exporting link batch %s.')
 
     links = shapefile.Writer(filepath, )
     links.field('link_id', 'C')
@@ -77,19 +74,15 @@ def export_links(database: SqliteUtil, filepath: str, src_epsg: int,
     links.field('air_temperature', 'N')
     links.field('mrt_temperature', 'N')
 
-    for row in rows:
-        props = row[:-2]
-        pt1, pt2 = row[-2:]
-        x1, y1 = project(*xy(pt1))
-        x2, y2 = project(*xy(pt2))
+    for batch in batches:
+        rows = batch.tolist()
+        x1, y1 = project(batch.source_x, batch.source_y)
+        x2, y2 = project(batch.terminal_x, batch.terminal_y)
+        coords = zip(x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist())
 
-        try:
-            links.record(*props)
-        except:
-            print(props)
-            breakpoint()
-            exit()
-        links.line([((x1, y1), (x2, y2))])
+        for row, (xa, ya, xb, yb) in zip(rows, coords):
+            links.record(*row[:-4])
+            links.line([((xa, ya), (xb, yb))])
 
     if links.recNum != links.shpNum:
         log.error('Record/shape misalignment; shapefile exporting failure.')
@@ -137,7 +130,7 @@ def main():
     log.info('Running link export tool.')
     log.info(f'Loading run data from {home}.')
 
-    database = SqliteUtil(path('database.db'), readonly=True)
+    database = open_database(home, 'network', readonly=True)
 
     try:
         export_links(database, args.file, 2223, args.epsg)
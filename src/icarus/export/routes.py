@@ -8,9 +8,10 @@ from typing import List
 from argparse import ArgumentParser
 from pyproj import Transformer, Geod
 
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
 from icarus.util.config import ConfigUtil
 from icarus.util.general import counter
+from icarus.util.snapshot import load_snapshot
 
 
 class Node:
@@ -50,7 +51,6 @@ def export_routes(database: SqliteUtil, modes: List[str],
     transform = transformer.transform
 
     measurer = Geod(f'epsg:{epsg}')
-    measure = lambda n1, n2: measurer.inv([n1.y], [n1.x], [n2.y], [n2.x])
 
     prjpath = os.path.splitext(filepath)[0] + '.prj'
     with open(prjpath, 'w') as prjfile:
@@ -58,36 +58,23 @@ def export_routes(database: SqliteUtil, modes: List[str],
         prjfile.write(info)
 
     log.info('Loading network node data.')
-    query = '''
-        SELECT
-            node_id,
-            point
-        FROM nodes;
-    '''
-    nodes = {}
-    database.cursor.execute(query)
-    result = counter(database.fetch_rows(), 'Loading node %s.')
-
-    for node_id, point in result:
-        x, y = transform(*map(float, point[7:-1].split(' ')))
-        nodes[node_id] = Node(x, y)
+    network = load_snapshot(database)
+    xs, ys = transform(network.node_x, network.node_y)
+    nodes = [Node(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
     
     log.info('Loading network link data.')
-    query = '''
-        SELECT 
-            link_id,
-            source_node,
-            terminal_node
-        FROM links;
-    '''
-    links = {}
-    database.cursor.execute(query)
-    result = counter(database.fetch_rows(), 'Loading link %s.')
+    sources = network.link_source
+    terminals = network.link_terminal
+    _, _, lengths = measurer.inv(xs[sources], ys[sources], 
+        xs[terminals], ys[terminals])
+    result = zip(network.link_ids.tolist(), sources.tolist(), 
+        terminals.tolist(), lengths.tolist())
+    result = counter(result, 'Loading link %s.')
 
-    for link_id, source_node, terminal_node in result:
+    links = {}
+    for link_id, source_node, terminal_node, length in result:
         src_node = nodes[source_node]
         term_node = nodes[terminal_node]
-        length = measure(src_node, term_node)
         links[link_id] = Link(src_node, term_node, length)
 
 
@@ -111,7 +98,7 @@ def export_routes(database: SqliteUtil, modes: List[str],
             output_events.leg_idx;
     '''
     database.cursor.execute(query)
-    result = counter(database.fetch_rows(block=1000000),
+    result = counter(database.fetch_rows(block_size=1000000),
         'Exporting route %s.')
 
     routes = shapefile.Writer(filepath)
@@ -186,7 +173,7 @@ def main():
     log.info('Running route export tool.')
     log.info(f'Loading run data from {home}.')
 
-    database = SqliteUtil(path('database.db'), readonly=True)
+    database = open_database(home, 'output', readonly=True)
     config = ConfigUtil.load_config(path('config.json'))
 
     try:
@@ -5,7 +5,7 @@ from argparse import ArgumentParser
 
 from icarus.generate.plans.plans import Plans
 from icarus.util.config import ConfigUtil
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import open_database
 
 parser = ArgumentParser()
 parser.add_argument('--folder', type=str, dest='folder', default='.')
@@ -36,7 +36,7 @@ vehiclespath = path('input/vehicles.xml.gz')
 log.info('Running population generation tool.')
 log.info(f'Loading run data from {home}.')
 
-database = SqliteUtil(path('database.db'))
+database = open_database(home, 'population')
 plans = Plans(database)
 
 
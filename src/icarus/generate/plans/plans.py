@@ -15,10 +15,6 @@ def hhmmss(secs):
     return ':'.join(str(t).zfill(2) for t in (hours, mins, secs))
 
 
-def xy(point):
-    return point[7:-1].split(' ')
-
-
 class Leg:
     __slots__ = ('agent_id', 'agent_idx', 'mode', 'duration')
 
@@ -125,7 +121,8 @@ class Plans:
                 activities.start,
                 activities.end,
                 activities.type,
-                parcels.center
+                parcels.x,
+                parcels.y
             FROM activities
             INNER JOIN parcels
             USING(apn)
@@ -135,7 +132,7 @@ class Plans:
                 agent_id,
                 agent_idx;  ''')
         for activity in self.database.cursor.fetchall():
-            yield Activity(list(activity[:-1]) + list(xy(activity[-1])))
+            yield Activity(activity)
 
     
     def fetch_legs(self, table):
@@ -5,7 +5,7 @@ from argparse import ArgumentParser
 
 from icarus.generate.population.population import Population
 from icarus.util.config import ConfigUtil
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import open_database
 
 parser = ArgumentParser()
 parser.add_argument('--folder', type=str, dest='folder', default='.')
@@ -13,6 +13,7 @@ parser.add_argument('--log', type=str, dest='log', default=None)
 parser.add_argument('--level', type=str, dest='level', default='info',
     choices=('notset', 'debug', 'info', 'warning', 'error', 'critical'))
 parser.add_argument('--replace', dest='replace', action='store_true', default=False)
+parser.add_argument('--fused', dest='fused', action='store_true', default=False)
 args = parser.parse_args()
 
 handlers = []
@@ -30,14 +31,18 @@ home = path('')
 log.info('Running population generation tool.')
 log.info(f'Loading run data from {home}.')
 
-database = SqliteUtil(path('database.db'))
+database = open_database(home, 'population')
 config = ConfigUtil.load_config(path('config.json'))
 
 seed = config['population']['seed']
+chunk_size = config['population'].get('chunk_size', 10000)
+batch_size = config['population'].get('batch_size', 100000)
+workers = config['resources']['cores']
+trips_file = config['population']['trips_file'] if args.fused else None
 
 population = Population(database)
 
-if not population.ready():
+if not population.ready(trips_file):
     log.warning('Dependent data not parsed or generated.')
     exit(1)
 elif population.complete():
@@ -48,7 +53,10 @@ elif population.complete():
 
 try:
     log.info('Starting population generation.')
-    population.generate(seed=seed)
+    with database.bulk_load():
+        population.generate(seed=seed, workers=workers,
+            chunk_size=chunk_size, batch_size=batch_size,
+            trips_file=trips_file)
 except:
     log.exception('Critical error while generating population; '
         'terminating process and exiting.')
@@ -1,4 +1,6 @@
 
+import logging as log
+
 from typing import Dict
 from icarus.generate.population.agent import Agent
 from icarus.generate.population.party import Party
@@ -15,7 +17,7 @@ class Household:
         self.parties = {}
         self.agents = {}
         self.vehicles = {}
-        self.groups = set()
+        self.groups = []
         self.parcel = None
         self.maz = None
 
@@ -71,7 +73,7 @@ class Household:
                 remove.add(key)
         for key in remove:
             del self.parties[key]
-        self.groups = filter(lambda group: len(group.agents) > 0, self.groups)
+        self.groups = [group for group in self.groups if len(group.agents) > 0]
 
     
     def identify(self):
@@ -129,12 +131,12 @@ class Household:
 
         if party.origin_group is None:
             party.set_origin_group(Group(trip.origin_maz))
-            self.groups.add(party.origin_group)
+            self.groups.append(party.origin_group)
         if party.dest_group is None:
             if next_party.origin_group is None:
                 party.set_dest_group(Group(trip.dest_maz))
                 next_party.set_origin_group(party.dest_group)
-                self.groups.add(party.dest_group)
+                self.groups.append(party.dest_group)
             else:
                 party.set_dest_group(next_party.origin_group)
         else:
@@ -150,16 +152,18 @@ class Household:
         try:
             agent.parse_trip(trip, vehicle, party)
         except Exception:
-            breakpoint()
+            log.error(f'Failed to parse trip for agent {trip.agent_id} in '
+                f'household {self.id}.')
+            raise
 
     
     def assign_parcels(self, network):
-        self.parcel = network.random_household_parcel(self.maz)
+        self.parcel = network.random_household_parcel(self.id, self.maz)
         for group in self.groups:
             parcel = None
             if group.home:
                 parcel = self.parcel
             else:
-                parcel = network.random_activity_parcel(group.maz)
+                parcel = network.random_activity_parcel(self.id, group.maz)
 
             group.assign_parcel(parcel)
@@ -1,10 +1,14 @@
 
-import random
+from __future__ import annotations
+
+import numpy as np
 import logging as log
 
-from shapely.geometry import Polygon
+from typing import List, Set, Tuple
+
 from icarus.util.sqlite import SqliteUtil
-from icarus.util.general import defaultdict, counter
+from icarus.util.distances import MazDistances, load_distances
+from icarus.util.hashing import splitmix64
 
 
 class Parcel:
@@ -14,131 +18,225 @@ class Parcel:
         self.apn = apn
 
 
-class Region:
-    __slots__ = ('polygon',)
+def household_random(seed: int, households: np.ndarray, 
+        draws: np.ndarray) -> np.ndarray:
+    seed = np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+    keys = splitmix64(seed ^ splitmix64(households))
+    return splitmix64(keys + np.asarray(draws, dtype=np.uint64))
+
+
+class DeferredNetwork:
+    def __init__(self):
+        self.requests: List[Tuple[int,bool,int]] = []
+
+
+    def request_parcel(self, hhid: int, household: bool, maz: int) -> Parcel:
+        self.requests.append((hhid, household, maz))
+        return Parcel(len(self.requests) - 1)
+
+
+    def random_household_parcel(self, hhid: int, maz: int) -> Parcel:
+        return self.request_parcel(hhid, True, maz)
+
+
+    def random_activity_parcel(self, hhid: int, maz: int) -> Parcel:
+        return self.request_parcel(hhid, False, maz)
+
+
+class ParcelSampler:
+    kinds = ('residential', 'commercial', 'other', 'default')
+    RESIDENTIAL, COMMERCIAL, OTHER, DEFAULT = range(4)
+
+    household_preference = (RESIDENTIAL, COMMERCIAL, OTHER, DEFAULT)
+    activity_preference = (COMMERCIAL, OTHER, RESIDENTIAL, DEFAULT)
+
+    def __init__(self, apns: np.ndarray, mazs: np.ndarray, kinds: np.ndarray,
+            seed: int):
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        codes = np.full(len(kinds), -1, dtype=np.int64)
+        for code, kind in enumerate(self.kinds):
+            codes[kinds == kind] = code
+        known = codes >= 0
+        apns, mazs, codes = apns[known], mazs[known], codes[known]
+
+        shuffle = self.rng.permutation(len(apns))
+        order = shuffle[np.lexsort((codes[shuffle], mazs[shuffle]))]
+        self.apns = apns[order]
+        self.keys = np.unique(mazs)
+
+        groups = np.searchsorted(self.keys, mazs[order]) * len(self.kinds) \
+            + codes[order]
+        bounds = np.searchsorted(groups,
+            np.arange(len(self.keys) * len(self.kinds) + 1))
+        self.starts = bounds[:-1].reshape(len(self.keys), len(self.kinds))
+        self.counts = np.diff(bounds).reshape(len(self.keys), len(self.kinds))
+        self.counts[:,self.DEFAULT] = self.counts[:,self.DEFAULT].clip(0, 1)
+
+        self.mazs = set(self.keys[self.counts[:,self.DEFAULT] > 0].tolist())
+        self.load_homes(np.zeros(0, dtype=np.int64), 
+            np.zeros(0, dtype=np.int64))
+
+
+    def load_homes(self, hhids: np.ndarray, mazs: np.ndarray):
+        hhids = np.asarray(hhids, dtype=np.int64)
+        mazs = np.asarray(mazs, dtype=np.int64)
+
+        # rank each household among those sharing its home maz by hhid, so
+        # home parcels cycle through a maz without depending on run order
+        order = np.lexsort((hhids, mazs))
+        ordered = mazs[order]
+        first = np.ones(len(ordered), dtype=bool)
+        first[1:] = ordered[1:] != ordered[:-1]
+        steps = np.arange(len(ordered))
+        ranks = np.empty(len(ordered), dtype=np.int64)
+        ranks[order] = steps - np.maximum.accumulate(np.where(first, steps, 0))
+
+        order = np.argsort(hhids, kind='stable')
+        self.homes = hhids[order]
+        self.home_mazs = mazs[order]
+        self.home_ranks = ranks[order]
+
 
-    @staticmethod
-    def region_coords(region: str):
-        coords = []
-        points = region[10:-2].split(', ')
-        for point in points:
-            x, y = point.split(' ')
-            coords.append((float(x) * 0.3048, float(y) * 0.3048))
-        return coords
-    
-    def __init__(self, polygon: str):
-        self.polygon = Polygon(self.region_coords(polygon))
+    def sample(self, hhids: np.ndarray, households: np.ndarray, 
+            mazs: np.ndarray) -> List[str]:
+        hhids = np.asarray(hhids, dtype=np.int64)
+        households = np.asarray(households, dtype=bool)
+        mazs = np.asarray(mazs, dtype=np.int64)
+        size = len(mazs)
+        if not size or not len(self.keys):
+            return [None] * size
+
+        idxs = np.searchsorted(self.keys, mazs).clip(0, len(self.keys) - 1)
+        valid = (self.keys[idxs] == mazs) & \
+            (self.counts[idxs,self.DEFAULT] > 0)
+
+        kinds = np.full(size, self.DEFAULT, dtype=np.int64)
+        for household, preference in ((True, self.household_preference),
+                (False, self.activity_preference)):
+            selected = valid & (households == household)
+            for kind in reversed(preference):
+                kinds[selected & (self.counts[idxs,kind] > 0)] = kind
+
+        first = np.ones(size, dtype=bool)
+        first[1:] = hhids[1:] != hhids[:-1]
+        steps = np.arange(size)
+        draws = steps - np.maximum.accumulate(np.where(first, steps, 0))
+        randoms = household_random(self.seed, hhids, draws)
+
+        counts = self.counts[idxs,kinds]
+        positions = (randoms % np.maximum(counts, 1).astype(np.uint64)) \
+            .astype(np.int64)
+        positions[kinds == self.DEFAULT] = 0
+
+        robin = np.flatnonzero(valid & households &
+            (kinds == self.RESIDENTIAL))
+        if len(robin) and len(self.homes):
+            homes = np.searchsorted(self.homes, hhids[robin]) \
+                .clip(0, len(self.homes) - 1)
+            known = (self.homes[homes] == hhids[robin]) & \
+                (self.home_mazs[homes] == mazs[robin])
+            robin, homes = robin[known], homes[known]
+            positions[robin] = self.home_ranks[homes] % counts[robin]
+
+        parcels = np.where(valid, self.starts[idxs,kinds] + positions, 0)
+        apns = np.where(valid, self.apns[parcels], None)
+
+        return apns.tolist()
 
 
 class Network:
     def __init__(self, database: SqliteUtil, seed: int):
         self.database = database
+        self.seed = seed
         self.loaded = False
-        random.seed(seed)
 
-    
+
+    @classmethod
+    def shared(cls, mazs: Set[int], distances: MazDistances) -> Network:
+        network = cls(None, None)
+        network.mazs = mazs
+        network.distances = distances
+        network.loaded = True
+        return network
+
+
+    def share(self) -> Tuple[Set[int], MazDistances]:
+        return self.mazs, self.distances
+
+
     def fetch_parcels(self):
-        self.database.cursor.execute(f'''
+        query = '''
             SELECT
                 apn,
                 maz,
                 type
             FROM parcels
-            ORDER BY 
-                RANDOM(); ''')
+            WHERE maz IS NOT NULL
+            ORDER BY rowid; '''
+        batches = list(self.database.fetch_batches(query,
+            dtypes={'apn': object, 'maz': np.int64, 'type': object}))
+        if not len(batches):
+            return (np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=object))
+
+        return tuple(np.concatenate([batch[name] for batch in batches])
+            for name in ('apn', 'maz', 'type'))
 
-        return self.database.cursor.fetchall()
 
-    
-    def fetch_regions(self):
+    def fetch_homes(self):
         query = '''
             SELECT
-                maz,
-                region
-            FROM regions;   '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
+                hhid,
+                homeMaz
+            FROM households
+            WHERE homeMaz IS NOT NULL; '''
+        batches = list(self.database.fetch_batches(query,
+            dtypes={'hhid': np.int64, 'homeMaz': np.int64}))
+        if not len(batches):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        return tuple(np.concatenate([batch[name] for batch in batches])
+            for name in ('hhid', 'homeMaz'))
 
 
     def load_parcels(self):
-        parcels = self.fetch_parcels()
-        self.residential_parcels = defaultdict(lambda x: [])
-        self.commercial_parcels = defaultdict(lambda x: [])
-        self.default_parcels = {}
-        self.other_parcels = defaultdict(lambda x: [])
-
-        for apn, maz, kind in counter(parcels, 'Loading parcel %s.'):
-            if kind == 'residential':
-                self.residential_parcels[maz].append(Parcel(apn))
-            elif kind == 'commercial':
-                self.commercial_parcels[maz].append(Parcel(apn))
-            elif kind == 'default':
-                self.default_parcels[maz] = Parcel(apn)
-            elif kind == 'other':
-                self.other_parcels[maz].append(Parcel(apn))
-
-        self.residential_parcels.lock()
-        self.commercial_parcels.lock()
-        self.other_parcels.lock()
-
-        self.mazs = set(self.default_parcels.keys())
-        self.offset = defaultdict(lambda x: 0)
-
-
-    def load_regions(self):
-        regions = self.fetch_regions()
-        self.regions = {}
-        for maz, polygon in counter(regions, 'Loading region %s.'):
-            self.regions[maz] = Region(polygon)
-        return regions
-
-
-    def load_network(self):
+        apns, mazs, kinds = self.fetch_parcels()
+        log.info(f'Loaded {len(apns)} parcels.')
+        self.sampler = ParcelSampler(apns, mazs, kinds, self.seed)
+        self.mazs = self.sampler.mazs
+
+
+    def load_homes(self, homes: Tuple[np.ndarray,np.ndarray] = None):
+        if homes is None:
+            homes = self.fetch_homes()
+        log.info(f'Loaded home mazs for {len(homes[0])} households.')
+        self.sampler.load_homes(*homes)
+
+
+    def load_distances(self, pairs: np.ndarray = None):
+        self.distances = load_distances(self.database, pairs)
+
+
+    def load_network(self, pairs: np.ndarray = None, 
+            homes: Tuple[np.ndarray,np.ndarray] = None):
         log.info('Loading parcel data.')
         self.load_parcels()
-        log.info('Loading region data.')
-        self.load_regions()
+        log.info('Loading household home mazs.')
+        self.load_homes(homes)
+        log.info('Loading maz distances.')
+        self.load_distances(pairs)
         self.loaded = True
 
 
     def minimum_distance(self, maz1: str, maz2: str) -> float:
-        distance = 0
-        if maz1 != maz2:
-            distance = self.regions[maz1].polygon.distance(
-                self.regions[maz2].polygon)
-        return distance
-
-
-    def random_household_parcel(self, maz:str) -> Parcel:
-        parcel = None
-        if maz in self.mazs:
-            if maz in self.residential_parcels:
-                idx = self.offset[maz]
-                parcel  = self.residential_parcels[maz][idx]
-                self.offset[maz] = (idx + 1) % len(self.residential_parcels[maz])
-            elif maz in self.commercial_parcels:
-                idx = random.randint(0, len(self.commercial_parcels[maz]) - 1)
-                parcel = self.commercial_parcels[maz][idx]
-            elif maz in self.other_parcels:
-                idx = random.randint(0, len(self.other_parcels[maz]) - 1)
-                parcel = self.other_parcels[maz][idx]
-            elif maz in self.default_parcels:
-                parcel = self.default_parcels[maz]
-        return parcel
-
-
-    def random_activity_parcel(self, maz: str) -> Parcel:
-        parcel = None
-        if maz in self.mazs:
-            if maz in self.commercial_parcels:
-                idx = random.randint(0, len(self.commercial_parcels[maz]) - 1)
-                parcel = self.commercial_parcels[maz][idx]
-            elif maz in self.other_parcels:
-                idx = random.randint(0, len(self.other_parcels[maz]) - 1)
-                parcel = self.other_parcels[maz][idx]
-            elif maz in self.residential_parcels:
-                idx = random.randint(0, len(self.residential_parcels[maz]) - 1)
-                parcel = self.residential_parcels[maz][idx]
-            elif maz in self.default_parcels:
-                parcel = self.default_parcels[maz]
-        return parcel
+        return self.distances.get(maz1, maz2)
+
+
+    def resolve_parcels(self, 
+            requests: List[Tuple[int,bool,int]]) -> List[str]:
+        if not len(requests):
+            return []
+        hhids, households, mazs = zip(*requests)
+        return self.sampler.sample(hhids, households, mazs)
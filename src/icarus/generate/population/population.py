@@ -1,15 +1,23 @@
 
+import numpy as np
 import logging as log
-from typing import Callable
+from typing import Iterable, Iterator, List, Set
 
-from icarus.generate.population.network import Network
+from icarus.generate.population.network import Network, DeferredNetwork
 from icarus.generate.population.subpopulation import Subpopulation
 from icarus.generate.population.trip import Trip
 from icarus.generate.population.party import Party
-from icarus.generate.population.agent import Agent, Leg
-from icarus.generate.population.types import Mode, ActivityType, RouteMode
+from icarus.generate.population.group import Group
+from icarus.generate.population.agent import Agent, Activity, Leg
+from icarus.generate.population.types import Mode, ActivityType
+from icarus.generate.population.validation import Validator, log_report
+from icarus.parse.abm import load_trips, load_trip_mazs
 from icarus.util.sqlite import SqliteUtil
-from icarus.util.general import chunk, defaultdict
+from icarus.util.file import exists
+from icarus.util.indexes import create_indexes
+from icarus.util.distances import MazDistances
+from icarus.util.general import pmap
+from icarus.util.iter import chunk
 
 
 class Population:
@@ -57,8 +65,9 @@ class Population:
         self.database.connection.commit()
 
 
-    def fetch_trips(self, min_household, max_household):
-        self.database.cursor.execute(f'''
+    def fetch_households(self, batch_size=100000):
+        cursor = self.database.connection.cursor()
+        cursor.execute('''
             SELECT
                 hhid,
                 pnum,
@@ -77,40 +86,48 @@ class Population:
                 isamAdjArrMin,
                 isamAdjDurMin
             FROM trips
-            WHERE hhid >= {min_household}
-            AND hhid < {max_household}; ''')
-        return self.database.cursor.fetchall()
-
-
-    def create_indexes(self):
-        query = 'CREATE INDEX agents_agent ON agents(agent_id);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX agents_household ON agents(household_id, household_idx);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX legs_leg ON legs(leg_id);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX legs_agent ON legs(agent_id, agent_idx);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX activities_activity ON activities(activity_id);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX activities_agent ON activities(agent_id, agent_idx);'
-        self.database.connection.execute(query)
-        query = 'CREATE INDEX activities_parcel ON activities(apn);'
-        self.database.connection.execute(query)
-
-
-    def fetch_max(self, table, column):
-        self.database.cursor.execute(f'SELECT MAX({column}) FROM {table};')
-        return self.database.cursor.fetchall()[0][0]
+            ORDER BY
+                hhid,
+                pnum,
+                personTripNum; ''')
+        def fetch_trips():
+            trips = cursor.fetchmany(batch_size)
+            while len(trips):
+                yield from trips
+                trips = cursor.fetchmany(batch_size)
+
+        try:
+            yield from group_households(fetch_trips())
+        finally:
+            cursor.close()
+
+
+    def load_households(self, trips_file):
+        trips = (trip[2:] for trip in load_trips(trips_file))
+        last = None
+        for household in group_households(trips):
+            hhid = household[0][0]
+            if last is not None and hhid <= last:
+                log.error(f'Household {hhid} follows household {last} in '
+                    f'{trips_file}; trips must be sorted by household.')
+                raise ValueError('Trips file not sorted by household.')
+            last = hhid
+            household.sort(key=lambda trip: (trip[1], trip[2]))
+            yield household
 
     
-    def ready(self):
-        tables = ('trips', 'regions', 'parcels')
-        exists = self.database.table_exists(*tables)
-        if len(exists) < len(tables):
-            missing = ', '.join(set(tables) - set(exists))
+    def ready(self, trips_file=None):
+        tables = ('trips', 'households', 'regions', 'parcels')
+        if trips_file is not None:
+            tables = ('regions', 'parcels')
+            if not exists(trips_file):
+                log.info(f'Could not find trips file {trips_file}.')
+                return False
+        found = self.database.table_exists(*tables)
+        if len(found) < len(tables):
+            missing = ', '.join(set(tables) - set(found))
             log.info(f'Could not find tables {missing} in database.')
-        return len(exists) == len(tables)
+        return len(found) == len(tables)
 
 
     def complete(self):
@@ -122,10 +139,8 @@ class Population:
         return len(exists) > 0
     
 
-    def generate(self, modes=None, activity_types=None, seed=None):
-        log.info('Loading process metadata.')
-        size = self.fetch_max('households', 'hhid')
-
+    def generate(self, modes=None, activity_types=None, seed=None, workers=1,
+            chunk_size=10000, batch_size=100000, trips_file=None):
         if modes is None:
             modes = set(Mode)
         else:
@@ -135,87 +150,130 @@ class Population:
         else:
             activity_types = set((ActivityType(act) for act in activity_types))
 
+        if seed is None:
+            seed = int(np.random.default_rng().integers(2 ** 63))
+            log.info(f'No population seed given; using seed {seed}.')
+
         log.info('Preparing tables for population.')
         self.create_tables()
         
         log.info('Loading network data.')
         network = Network(self.database, seed)
-        network.load_network()
+        if trips_file is None:
+            network.load_network()
+            households = self.fetch_households(batch_size)
+        else:
+            log.info(f'Finding maz pairs and home mazs used by trips in '
+                f'{trips_file}.')
+            network.load_network(*load_trip_mazs(trips_file))
+            households = self.load_households(trips_file)
+
+        def fetch_chunks():
+            for idx, piece in enumerate(chunk(households, chunk_size)):
+                log.info(f'Fetched trips for households {idx * chunk_size}'
+                    f' to {idx * chunk_size + len(piece)}.')
+                yield piece
 
         log.info('Iterating over trips for each household.')
+        results = pmap(generate_households, fetch_chunks(), workers, 
+            initialize_worker, (*network.share(), modes, activity_types))
+
+        agent_offset = activity_offset = leg_offset = 0
+        party_offset = group_offset = 0
+        report = {}
+        removed = 0
+        for agents, activities, legs, requests, counts, checks, \
+                dropped in results:
+            for name, stats in checks.items():
+                report[name] = [total + value for total, value 
+                    in zip(report.get(name, (0, 0, 0.0)), stats)]
+            removed += dropped
 
-        # error = defaultdict(int)
-
-        def valid_party(party: Party) -> bool:
-            return party.driver is not None or party.mode != RouteMode.CAR
-
-        def valid_leg(leg: Leg) -> bool:
-            distance = network.minimum_distance(leg.party.origin_group.maz, 
-                leg.party.dest_group.maz)
-            duration = leg.end - leg.start
-            valid = False
-            if duration > 0:
-                valid = distance / duration < leg.mode.route_mode().max_speed()
-            elif distance == 0:
-                valid = True
-            return valid
-
-        def valid_agent(agent: Agent) -> bool:
-            return (
-                agent.modes.issubset(modes)
-                and agent.activity_types.issubset(activity_types)
-                and agent.mazs.issubset(network.mazs)
-                and all(valid_party(party) for party in agent.parties)
-                and all(valid_leg(leg) for leg in agent.legs)
-            )
-
-        # def valid_agent(agent: Agent) -> bool:
-        #     valid = True
-        #     if not agent.modes.issubset(modes):
-        #         error['mode'] += 1
-        #         valid = False
-        #     if not agent.activity_types.issubset(activity_types):
-        #         error['activity'] += 1
-        #         valid = False
-        #     if any(not valid_party(party) for party in agent.parties):
-        #             error['party'] += 1
-        #             valid = False
-        #     if not agent.mazs.issubset(network.mazs):
-        #         error['maz'] += 1
-        #         valid = False
-        #     elif any(not valid_leg(leg) for leg in agent.legs):
-        #         error['leg'] += 1
-        #         valid = False
-        #     return valid
-
-        for min_household, max_household in chunk(0, size, 100000):
-            log.info(f'Fetching trips from household {min_household}'
-                f' to {max_household}.')
-            subpopulation = Subpopulation()
-            trips = self.fetch_trips(min_household, max_household)
-
-            log.info('Parsing fetched trips.')
-            for trip_data in trips:
-                trip = Trip(trip_data)
-                subpopulation.parse_trip(trip)
-
-            log.info('Filtering agents.')
-            subpopulation.filter(valid_agent)
-            log.info('Cleaning up population.')
-            subpopulation.clean()
             log.info('Assigning parcels to activities.')
-            subpopulation.assign_parcels(network)
-            log.info('Identifying activity, leg and agent ids.')
-            subpopulation.identify()
+            apns = network.resolve_parcels(requests)
 
             log.info('Writing generated population to database.')
-            agents = subpopulation.export_agents()
+            agents = ((agent_id + agent_offset, *agent) 
+                for agent_id, *agent in agents)
             self.database.insert_values('agents', agents, 9)
-            activities = subpopulation.export_activities()
+            activities = ((activity_id + activity_offset, 
+                    agent_id + agent_offset, agent_idx, kind, apns[parcel],
+                    group + group_offset if group else 0, start, end, duration)
+                for activity_id, agent_id, agent_idx, kind, parcel, group, 
+                    start, end, duration in activities)
             self.database.insert_values('activities', activities, 9)
-            legs = subpopulation.export_legs()
+            legs = ((leg_id + leg_offset, agent_id + agent_offset, agent_idx,
+                    mode, party + party_offset if party else 0, start, end,
+                    duration)
+                for leg_id, agent_id, agent_idx, mode, party, start, end,
+                    duration in legs)
             self.database.insert_values('legs', legs, 8)
             self.database.connection.commit()
 
-        self.create_indexes()
+            agent_offset += counts[0]
+            activity_offset += counts[1]
+            leg_offset += counts[2]
+            party_offset += counts[3]
+            group_offset += counts[4]
+
+        log_report(report, removed)
+        metadata = {}
+        for name, (evaluated, rejected, elapsed) in report.items():
+            metadata[f'population_{name}_evaluated'] = evaluated
+            metadata[f'population_{name}_rejected'] = rejected
+            metadata[f'population_{name}_seconds'] = elapsed
+        metadata['population_removed'] = removed
+        self.database.write_metadata(metadata)
+
+        create_indexes(self.database, 'agents', 'activities', 'legs')
         self.database.connection.commit()
+
+
+def group_households(trips: Iterable[tuple]) -> Iterator[List[tuple]]:
+    household = []
+    for trip in trips:
+        if len(household) and household[0][0] != trip[0]:
+            yield household
+            household = []
+        household.append(trip)
+    if len(household):
+        yield household
+
+
+def initialize_worker(mazs: Set[int], distances: MazDistances,
+        modes: Set[Mode], activity_types: Set[ActivityType]):
+    global validator
+    network = Network.shared(mazs, distances)
+    validator = Validator(network, modes, activity_types)
+
+
+def generate_households(households: List[List[tuple]]) -> tuple:
+    Agent.uuid = Activity.uuid = Leg.uuid = Party.uuid = Group.uuid = 0
+    subpopulation = Subpopulation()
+
+    log.info('Parsing fetched trips.')
+    for trips in households:
+        for trip_data in trips:
+            trip = Trip(trip_data)
+            subpopulation.parse_trip(trip)
+    subpopulation.flush()
+
+    log.info('Filtering agents.')
+    validator.prepare(agent for household in subpopulation.households.values()
+        for agent in household.agents.values())
+    removed = subpopulation.filter(validator)
+    log.info('Cleaning up population.')
+    subpopulation.clean()
+    log.info('Deferring parcel assignment for activities.')
+    parcels = DeferredNetwork()
+    subpopulation.assign_parcels(parcels)
+    log.info('Identifying activity, leg and agent ids.')
+    subpopulation.identify()
+
+    agents = list(subpopulation.export_agents())
+    activities = list(subpopulation.export_activities())
+    legs = list(subpopulation.export_legs())
+    counts = (Agent.uuid, Activity.uuid, Leg.uuid, Party.uuid, Group.uuid)
+
+    return (agents, activities, legs, parcels.requests, counts,
+        validator.report(), removed)
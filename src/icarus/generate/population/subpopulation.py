@@ -30,6 +30,13 @@ class Subpopulation:
             else:
                 self.households[hhid].parse_trip(self.last_trip, None)
         self.last_trip = trip
+
+
+    def flush(self):
+        if self.last_trip is not None:
+            hhid = self.last_trip.household_id
+            self.households[hhid].parse_trip(self.last_trip, None)
+            self.last_trip = None
     
     
     def filter(self, valid: Callable[[Agent], bool]) -> int:
@@ -0,0 +1,139 @@
+
+import numpy as np
+import logging as log
+
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from icarus.generate.population.agent import Agent
+from icarus.generate.population.party import Party
+from icarus.generate.population.network import Network
+from icarus.generate.population.types import Mode, ActivityType, RouteMode
+
+
+class Validator:
+    def __init__(self, network: Network, modes: Set[Mode],
+            activity_types: Set[ActivityType]):
+        self.network = network
+        self.modes = modes
+        self.activity_types = activity_types
+        self.slow_agents: Set[int] = set()
+
+        self.max_speeds = {}
+        for mode in Mode:
+            route_mode = mode.route_mode()
+            self.max_speeds[mode] = np.nan if route_mode is None \
+                else route_mode.max_speed()
+
+        self.checks: Dict[str,Callable[[Agent],bool]] = {
+            'modes': self.valid_modes,
+            'activity_types': self.valid_activity_types,
+            'mazs': self.valid_mazs,
+            'parties': self.valid_parties,
+            'speeds': self.valid_speeds
+        }
+        self.order = list(self.checks.keys())
+        self.stats = {name: [0, 0, 0.0] for name in self.checks}
+        self.reported = {name: [0, 0, 0.0] for name in self.checks}
+
+
+    def valid_modes(self, agent: Agent) -> bool:
+        return agent.modes.issubset(self.modes)
+
+
+    def valid_activity_types(self, agent: Agent) -> bool:
+        return agent.activity_types.issubset(self.activity_types)
+
+
+    def valid_mazs(self, agent: Agent) -> bool:
+        return agent.mazs.issubset(self.network.mazs)
+
+
+    def valid_parties(self, agent: Agent) -> bool:
+        return all(valid_party(party) for party in agent.parties)
+
+
+    def valid_speeds(self, agent: Agent) -> bool:
+        return id(agent) not in self.slow_agents
+
+
+    def prepare(self, agents: Iterable[Agent]):
+        start = perf_counter()
+        owners, origins, dests, durations, speeds = [], [], [], [], []
+        for agent in agents:
+            for leg in agent.legs:
+                owners.append(id(agent))
+                origins.append(leg.party.origin_group.maz)
+                dests.append(leg.party.dest_group.maz)
+                durations.append(leg.end - leg.start)
+                speeds.append(self.max_speeds[leg.mode])
+
+        distances = self.network.distances.lookup(
+            np.array(origins, dtype=np.int64), np.array(dests, dtype=np.int64))
+        durations = np.array(durations, dtype=np.float64)
+        speeds = np.array(speeds, dtype=np.float64)
+
+        valid = np.zeros(len(owners), dtype=bool)
+        moving = durations > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valid[moving] = distances[moving] / durations[moving] \
+                < speeds[moving]
+        valid[~moving] = distances[~moving] == 0
+
+        owners = np.array(owners, dtype=np.int64)
+        self.slow_agents = set(owners[~valid].tolist())
+        self.stats['speeds'][2] += perf_counter() - start
+        self.reorder()
+
+
+    def reorder(self):
+        def score(name: str) -> float:
+            evaluated, rejected, elapsed = self.stats[name]
+            if evaluated == 0:
+                return 0.0
+            return elapsed / evaluated / ((rejected + 1) / (evaluated + 1))
+
+        order = sorted(self.checks.keys(), key=score)
+        if order != self.order:
+            log.debug(f'Reordered agent checks to {", ".join(order)}.')
+        self.order = order
+
+
+    def __call__(self, agent: Agent) -> bool:
+        for name in self.order:
+            stats = self.stats[name]
+            start = perf_counter()
+            valid = self.checks[name](agent)
+            stats[2] += perf_counter() - start
+            stats[0] += 1
+            if not valid:
+                stats[1] += 1
+                return False
+        return True
+
+
+    def report(self) -> Dict[str,Tuple[int,int,float]]:
+        report = {}
+        for name, stats in self.stats.items():
+            reported = self.reported[name]
+            report[name] = tuple(total - last
+                for total, last in zip(stats, reported))
+            self.reported[name] = list(stats)
+        return report
+
+
+def valid_party(party: Party) -> bool:
+    return party.driver is not None or party.mode != RouteMode.CAR
+
+
+def log_report(report: Dict[str,List], removed: int):
+    lines = [f'{name}: {rejected} of {evaluated} agents rejected '
+            f'in {elapsed:.3f}s'
+        for name, (evaluated, rejected, elapsed) in report.items()]
+    rejected = sum(stats[1] for stats in report.values())
+    log.info('Agent validation results:\n'
+        '===================================================\n'
+        + '\n'.join(lines) + '\n'
+        f'dependents removed: {removed - rejected}\n'
+        f'total removed: {removed}\n'
+        '===================================================')
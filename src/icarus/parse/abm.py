@@ -1,13 +1,17 @@
 
 import os
-import csv
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
 import logging as log
 
 from argparse import ArgumentParser
+from typing import Dict, Tuple
 
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes
 from icarus.util.config import ConfigUtil
-from icarus.util.file import multiopen, exists
+from icarus.util.file import exists
 from icarus.util.general import counter
 
 
@@ -121,90 +125,153 @@ def create_tables(database: SqliteUtil):
     database.connection.commit()
 
 
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE  INDEX trips_trip ON 
-        trips(hhid, pnum, personTripNum);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX household_households 
-        ON households(hhid);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX persons_person 
-        ON persons(hhid, pnum); 
-    '''
-    database.cursor.execute(query)
-    database.connection.commit()
-
-
-def load_trips(trips_file: str):
-    open_file = multiopen(trips_file, 'rt')
-    trips = csv.reader(open_file, delimiter=',', quotechar='"')
-    next(trips)
-    trips = counter(trips, 'Parsing trip %s.')
-
-    for trip in trips:
-        yield [int(t) for t in trip[0:6]] + [trip[6]] + \
-            [int(t) for t in trip[7:15]] + [float(t) for t in trip[15:18]]
-
-    open_file.close()
-
-
-def load_households(households_file: str):
-    open_file = multiopen(households_file, 'rt')
-    households = csv.reader(open_file, delimiter=',', quotechar='"')
-    next(households)
-    households = counter(households, 'Parsing household %s.')
-
-    for household in households:
-        yield [int(h) for h in household[0:2]] + [float(household[2])] + \
-            [int(h) for h in household[3:18]]
-        
-    open_file.close()
-
-
-def load_persons(persons_file: str):
-    open_file = multiopen(persons_file, 'rt')
-    persons = csv.reader(open_file, delimiter=',', quotechar='"')
-    next(persons)
-    persons = counter(persons, 'Loading person %s.')
+def schema(names: str, dtypes: str) -> Tuple[Tuple[str,str], ...]:
+    names = names.split()
+    dtypes = [{'i': 'int64', 'f': 'float64', 's': 'object'}[dtype] 
+        for dtype in dtypes]
+    return tuple(zip(names, dtypes))
+
+
+schemas = {
+    'trips': schema('''
+        hhid_uniqueid uniqueid hhid pnum personTripNum jointTripRole party 
+        origTaz origMaz destTaz destMaz origPurp destPurp mode vehId 
+        isamAdjDepMin isamAdjArrMin isamAdjDurMin ''',
+        'iiiiiisiiiiiiiifff'),
+    'households': schema('''
+        hhid hhidAcrossSample pumsSerialNo homeTaz homeMaz hhsize 
+        numFtWorkers numPtWorkers numUnivStuds numNonWorkers numRetired 
+        numDrivAgeStuds numPreDrivStuds numPreschool hhIncomeDollar 
+        hhNumAutos dwellingType ifAvHousehold ''',
+        'iifiiiiiiiiiiiiiii'),
+    'persons': schema('''
+        hhid pnum pumsSerialNo persType personTypeDetailed age gender 
+        industry schlGrade educLevel workPlaceType workPlaceTaz workPlaceMaz 
+        schoolType schoolTaz schoolMaz campusBusinessTaz campusBusinessMaz 
+        usualCarID dailyActivityPattern specEvtParticipant jointTour1Role 
+        jointTour2Role obPeChauffBund1 obPeChauffBund2 obPeChauffBund3 
+        obRsChauffBund obPePassBund obRsPassBund ibPeChauffBund1 
+        ibPeChauffBund2 ibPeChauffBund3 ibRsChauffBund ibPePassBund 
+        ibRsPassBund studentDorm studentRent activityString transitPass ''',
+        'iifiiiiiiiiiiiiiiisiiiiiiiiiiiiiiiiiisi')
+}
+
+
+def read_blocks(filepath: str, table: str, block_size: int = 100000):
+    columns = schemas[table]
+    names = [name for name, _ in columns]
+    dtypes = {name: dtype for name, dtype in columns if dtype != 'object'}
+    strings = {name: str for name, dtype in columns if dtype == 'object'}
+    frames = pd.read_csv(filepath, header=0, names=names, 
+        usecols=range(len(columns)), dtype=dtypes, converters=strings, 
+        float_precision='round_trip', chunksize=block_size)
+    for frame in frames:
+        yield frame
+
+
+def load_trips(trips_file: str, block_size: int = 100000):
+    trips = (trip for block in read_blocks(trips_file, 'trips', block_size)
+        for trip in block.itertuples(index=False, name=None))
+    for trip in counter(trips, 'Parsing trip %s.'):
+        yield trip
+
+
+def first_trips(trips: np.ndarray) -> np.ndarray:
+    trips = trips[np.lexsort((trips[:,2], trips[:,1], trips[:,0]))]
+    first = np.ones(len(trips), dtype=bool)
+    first[1:] = trips[1:,0] != trips[:-1,0]
+    return trips[first]
+
+
+def load_trip_mazs(trips_file: str, block_size: int = 1000000) \
+        -> Tuple[np.ndarray,Tuple[np.ndarray,np.ndarray]]:
+    pairs = []
+    firsts = []
+    for block in read_blocks(trips_file, 'trips', block_size):
+        origin = block['origMaz'].to_numpy()
+        dest = block['destMaz'].to_numpy()
+        moved = origin != dest
+        block_pairs = np.column_stack((np.minimum(origin, dest)[moved],
+            np.maximum(origin, dest)[moved]))
+        pairs.append(np.unique(block_pairs, axis=0))
+        firsts.append(first_trips(block[['hhid', 'pnum', 'personTripNum', 
+            'origMaz']].to_numpy(dtype=np.int64)))
+    if not len(pairs):
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, 2), dtype=np.int64), (empty, empty)
+
+    # a household's first trip leaves from the maz its home parcel is
+    # requested in; households split across blocks are reduced again here
+    homes = first_trips(np.concatenate(firsts))
+    pairs = np.unique(np.concatenate(pairs), axis=0).astype(np.int64)
+
+    return pairs, (homes[:,0], homes[:,3])
+
+
+def load_table(table: str, filepath: str, queue, block_size: int):
+    try:
+        for block in read_blocks(filepath, table, block_size):
+            queue.put((table, block))
+        queue.put((table, None))
+    except Exception as error:
+        queue.put((table, error))
+
+
+def load_tables(files: Dict[str,str], block_size: int = 100000, 
+        workers: int = 1):
+    if workers <= 1:
+        for table, filepath in files.items():
+            for block in read_blocks(filepath, table, block_size):
+                yield table, block
+        return
+
+    queue = mp.Queue(maxsize=2 * len(files))
+    processes = [mp.Process(target=load_table, 
+            args=(table, filepath, queue, block_size))
+        for table, filepath in files.items()]
+    for process in processes:
+        process.start()
 
-    for person in persons:
-        yield [int(p) for p in person[0:2]] + [float(person[2])] + \
-            [int(p) for p in person[3:18]] + [person[18]] + \
-            [int(p) for p in person[19:37]] + [person[37]] + [int(person[38])]
-            
-    open_file.close()
+    try:
+        remaining = len(processes)
+        while remaining:
+            table, block = queue.get()
+            if block is None:
+                remaining -= 1
+            elif isinstance(block, Exception):
+                log.error(f'Failed to parse {files[table]} into {table}.')
+                raise block
+            else:
+                yield table, block
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
 
 
 def parse_abm(database: SqliteUtil, trips_file: str, households_file: str, 
-        persons_file: str):
+        persons_file: str, workers: int = 1, block_size: int = 100000):
     log.info('Allocating tables for households, persons and trips.')
     create_tables(database)
 
-    log.info('Parsing households.')
-    households = load_households(households_file)
-    database.insert_values('households', households, 18)
-    database.connection.commit()
-    del households
-
-    log.info('Parsing persons.')
-    persons = load_persons(persons_file)
-    database.insert_values('persons', persons, 39)
-    database.connection.commit()
-    del persons
-
-    log.info('Parsing trips.')
-    trips = load_trips(trips_file)
-    database.insert_values('trips', trips, 18)
-    database.connection.commit()
-    del trips
+    files = {
+        'households': households_file,
+        'persons': persons_file,
+        'trips': trips_file
+    }
+    counts = {table: 0 for table in files}
+    log.info('Parsing households, persons and trips.')
+    for table, block in load_tables(files, block_size, workers):
+        rows = block.itertuples(index=False, name=None)
+        database.insert_values(table, rows, len(schemas[table]))
+        database.connection.commit()
+        counts[table] += len(block)
+        log.info(f'Parsed {counts[table]} rows into {table}.')
 
     log.info('Creating indexes on new tables.')
-    create_indexes(database)
+    create_indexes(database, 'trips', 'households', 'persons')
 
 
 def main():
@@ -231,12 +298,13 @@ def main():
     log.info('Running MAG ABM parsing tool.')
     log.info(f'Loading run data from {home}.')
 
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'abm')
     config = ConfigUtil.load_config(path('config.json'))
 
     trips_file = config['population']['trips_file']
     persons_file = config['population']['persons_file']
     households_file = config['population']['households_file']
+    workers = config['resources']['cores']
 
     if not ready(trips_file, households_file, persons_file):
         log.warning('Dependent data not parsed or generated.')
@@ -249,7 +317,9 @@ def main():
 
     try:
         log.info('Starting population parsing.')
-        parse_abm(database, trips_file, households_file, persons_file)
+        with database.bulk_load():
+            parse_abm(database, trips_file, households_file, persons_file,
+                workers)
     except:
         log.exception('Critical error while parsing population; '
             'terminating process and exiting.')
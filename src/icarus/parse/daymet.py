@@ -1,29 +1,25 @@
 
 import os
 import logging as log
+import numpy as np
 
 from argparse import ArgumentParser
 from typing import List, Callable
 from netCDF4 import Dataset             # pylint: disable=no-name-in-module
 from pyproj import Transformer
-from rtree.index import Index
 from math import cos, pi
 
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes, drop_indexes
 from icarus.util.config import ConfigUtil
 from icarus.util.general import counter
+from icarus.util.file import fingerprint
+from icarus.util.snapshot import load_snapshot, write_snapshot, \
+    fingerprint_network
+from icarus.util.spatial import index_path, load_index, point_bounds, \
+    nearest_one
 
 
-class Point:
-    __slots__ = ('id', 'x', 'y', 'profile')
-
-    def __init__(self, uuid: int, x: float, y: float, profile: int):
-        self.id = uuid
-        self.x = x
-        self.y = y
-        self.profile = profile
-    
-
 class Link:
     __slots__ = ('id', 'x', 'y', 'air_temperature')
 
@@ -108,10 +104,6 @@ def ready(database: SqliteUtil, tmin_files: List[str], tmax_files: List[str]):
     return ready
 
 
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
-
-
 def iterpolation(tmin: float, tmax: float, tdawn: float, tpeak: float):
     return lambda t: (
         (tmax+tmin)/2-(tmax-tmin)/2*cos(pi*(tdawn-t)/(24+tdawn-tpeak)) 
@@ -121,9 +113,40 @@ def iterpolation(tmin: float, tmax: float, tdawn: float, tpeak: float):
         (tmax+tmin)/2-(tmax-tmin)/2*cos(pi*(24+tdawn-t)/(24+tdawn-tpeak)))
 
 
+def fingerprint_sources(database: SqliteUtil, tmin_files: List[str], 
+        tmax_files: List[str], day: int):
+    manifest = database.fetch_manifest('daymet')
+    entries = {}
+    for kind, t_files in (('tmin', tmin_files), ('tmax', tmax_files)):
+        for t_file in t_files:
+            entry = manifest.get(t_file)
+            previous = None if entry is None else entry[1:4]
+            entries[t_file] = (kind, *fingerprint(t_file, previous), day)
+    
+    return manifest, entries
+
+
+def unchanged(database: SqliteUtil, manifest: dict, entries: dict, 
+        steps: int):
+    if not len(database.table_exists('air_temperatures')):
+        return False
+    if set(manifest.keys()) != set(entries.keys()):
+        return False
+    for path, entry in entries.items():
+        if manifest[path][0] != entry[0] or manifest[path][3:] != entry[3:]:
+            return False
+    network = database.fetch_manifest('daymet_network')
+    if network != fingerprint_network(database, 'air_temperature'):
+        log.info('Links or parcels changed since the last run.')
+        return False
+    query = 'SELECT MAX(temperature_idx) FROM air_temperatures;'
+    database.cursor.execute(query)
+    
+    return database.cursor.fetchall()[0][0] == steps - 1
+
+
 def create_tables(database: SqliteUtil):
-    database.drop_table('air_temperatures', 'temp_links', 'temp_parcels',
-        'temp_links_merged', 'temp_parcels_merged')
+    database.drop_table('air_temperatures', 'temp_links', 'temp_parcels')
     query = '''
         CREATE TABLE air_temperatures(
             temperature_id MEDIUMINT UNSIGNED,
@@ -150,76 +173,15 @@ def create_tables(database: SqliteUtil):
     database.connection.commit()
 
 
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE INDEX air_temperatures_temperature
-        ON air_temperatures(temperature_id, temperature_idx); 
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_link
-        ON links(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node1
-        ON links(source_node);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node2
-        ON links(terminal_node);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_air
-        ON links(air_temperature);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_mrt
-        ON links(mrt_temperature);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX parcels_apn
-        ON parcels(apn);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX parcels_maz
-        ON parcels(maz);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX parcels_air
-        ON parcels(air_temperature);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX parcels_mrt
-        ON parcels(mrt_temperature);
-    '''
-    database.cursor.execute(query)
-    database.connection.commit()
-
-
 def load_links(database: SqliteUtil):
-    query = '''
-        SELECT
-            links.link_id,
-            nodes.point
-        FROM links
-        INNER JOIN nodes
-        ON links.source_node = nodes.node_id;
-    '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
+    network = load_snapshot(database)
+    xs = network.node_x[network.link_source].tolist()
+    ys = network.node_y[network.link_source].tolist()
+    rows = zip(network.link_ids.tolist(), xs, ys)
     rows = counter(rows, 'Loading link %s.')
 
     links = []
-    for link_id, point in rows:
-        x, y = xy(point)
+    for link_id, x, y in rows:
         link = Link(link_id, x, y)
         links.append(link)
 
@@ -232,7 +194,8 @@ def load_parcels(database: SqliteUtil):
             apn,
             type,
             cooling,
-            center
+            x,
+            y
         FROM parcels;
     '''
     database.cursor.execute(query)
@@ -240,8 +203,7 @@ def load_parcels(database: SqliteUtil):
     rows = counter(rows, 'Loading parcel %s.')
 
     parcels = []
-    for apn, kind, cooling, center in rows:
-        x, y = xy(center)
+    for apn, kind, cooling, x, y in rows:
         parcel = Parcel(apn, kind, bool(cooling), x, y)
         parcels.append(parcel)
 
@@ -250,7 +212,15 @@ def load_parcels(database: SqliteUtil):
 
 def parse_temperatures(database: SqliteUtil, tmin_files: List[str], 
         tmax_files: List[str], steps: int, day: int, src_epsg: int, 
-        prj_epsg: int):
+        prj_epsg: int, update: bool = False):
+
+    log.info('Checking daymet files against the source manifest.')
+    manifest, entries = fingerprint_sources(database, tmin_files, 
+        tmax_files, day)
+    if update and unchanged(database, manifest, entries, steps):
+        log.info('Daymet files and settings are unchanged since the last '
+            'run; keeping existing air temperatures.')
+        return
 
     log.info('Allocating tables for air temperatures.')
     create_tables(database)
@@ -260,6 +230,7 @@ def parse_temperatures(database: SqliteUtil, tmin_files: List[str],
     point_count = 0
     temperatures = []
     points = []
+    point_profiles = []
     profiles = {}
     n = 1
 
@@ -300,9 +271,8 @@ def parse_temperatures(database: SqliteUtil, tmin_files: List[str],
                         profiles[idx] = profile_count
                         profile_count += 1
                     
-                    profile = profiles[idx]
-                    point = Point(point_count, x, y, profile)
-                    points.append(point)
+                    points.append((x, y))
+                    point_profiles.append(profiles[idx])
                     point_count += 1
 
                     if point_count == n:
@@ -315,24 +285,22 @@ def parse_temperatures(database: SqliteUtil, tmin_files: List[str],
     if point_count != n >> 1:
         log.info(f'Loading air temperature reading {point_count}.')
     
-    def load():
-        for point in points:
-            x, y = point.x, point.y
-            yield (point.id, (x, y, x, y), point.profile)
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    point_profiles = np.array(point_profiles, dtype=np.int64)
 
     log.info('Starting network update for air temperatures.')
-    log.info('Building spatial index from temperature profile locations.')
-    index = Index(load())
+    log.info('Loading spatial index on temperature profile locations.')
+    index = load_index(index_path(database, 'daymet'), point_bounds(points))
     used = set()
     
     log.info('Loading network links.')
     links = load_links(database)
 
     log.info('Applying temperature profiles to links.')
-    iter_links = counter(links, 'Applying profile to link %s.')
-    for link in iter_links:
-        result = index.nearest((link.x, link.y, link.x, link.y), objects=True)
-        profile = next(result).object
+    coords = np.array([(link.x, link.y) for link in links], 
+        dtype=np.float64).reshape(-1, 2)
+    nearby = point_profiles[nearest_one(index, coords)]
+    for link, profile in zip(links, nearby.tolist()):
         link.air_temperature = profile
         used.add(profile)
 
@@ -365,15 +333,20 @@ def parse_temperatures(database: SqliteUtil, tmin_files: List[str],
     used.add(other)
 
     log.info('Applying temperature profiles to parcels.')
+    outdoor = [parcel for parcel in parcels if not parcel.cooling]
+    coords = np.array([(parcel.x, parcel.y) for parcel in outdoor], 
+        dtype=np.float64).reshape(-1, 2)
+    nearby = point_profiles[nearest_one(index, coords)]
+    for parcel, profile in zip(outdoor, nearby.tolist()):
+        parcel.air_temperature = profile
+        used.add(profile)
+    del outdoor
+
     iter_parcels = counter(parcels, 'Applying profile to parcel %s.')
     for parcel in iter_parcels:
         if not parcel.cooling:
-            x, y = xy(parcel.center)
-            result = index.nearest((x, y, x, y), objects=True)
-            profile = next(result).object
-            parcel.air_temperature = profile
-            used.add(profile)
-        elif parcel.kind == 'residential':
+            continue
+        if parcel.kind == 'residential':
             parcel.air_temperature = residential
         elif parcel.kind == 'commercial':
             parcel.air_temperature = commercial
@@ -402,88 +375,23 @@ def parse_temperatures(database: SqliteUtil, tmin_files: List[str],
     database.connection.commit()
     del temperatures
 
-    log.info('Merging, dropping and renaming old tables.')
-
-    query = '''
-        CREATE INDEX temp_links_link
-        ON temp_links(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE TABLE temp_links_merged
-        AS SELECT
-            links.link_id,
-            links.source_node,
-            links.terminal_node,
-            links.length,
-            links.freespeed,
-            links.capacity,
-            links.permlanes,
-            links.oneway,
-            links.modes,
-            temp_links.air_temperature,
-            links.mrt_temperature
-        FROM links
-        INNER JOIN temp_links
-        USING(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX temp_parcels_parcel
-        ON temp_parcels(apn);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE TABLE temp_parcels_merged
-        AS SELECT
-            parcels.apn,
-            parcels.maz,
-            parcels.type,
-            parcels.cooling,
-            temp_parcels.air_temperature,
-            parcels.mrt_temperature,
-            parcels.center,
-            parcels.region
-        FROM parcels
-        INNER JOIN temp_parcels
-        USING(apn);
-    '''
-    database.cursor.execute(query)
-
-    original = database.count_rows('links')
-    merged = database.count_rows('temp_links_merged')
-    if original != merged:
-        log.error('Original links and updated links tables '
-            'do not align; quiting to prevent data loss.')
-        raise RuntimeError
-    else:
-        database.drop_table('links', 'temp_links')
-        query = '''
-            ALTER TABLE temp_links_merged
-            RENAME TO links;
-        '''
-        database.cursor.execute(query)
-    
-    original = database.count_rows('parcels')
-    merged = database.count_rows('temp_parcels_merged')
-    if original != merged:
-        log.error('Original parcels and updated parcels tables '
-            'do not align; quiting to prevent data loss.')
-        raise RuntimeError
-    else:
-        database.drop_table('parcels', 'temp_parcels')
-        query = '''
-            ALTER TABLE temp_parcels_merged
-            RENAME TO parcels;
-        '''
-        database.cursor.execute(query)
-    
+    log.info('Patching air temperatures into links and parcels.')
+    drop_indexes(database, 'links', 'parcels')
+    database.patch_column('links', 'link_id', 'air_temperature', 'temp_links')
+    database.patch_column('parcels', 'apn', 'air_temperature', 'temp_parcels')
+    database.drop_table('temp_links', 'temp_parcels')
     database.connection.commit()
 
     log.info('Creating indexes on new tables.')
-    create_indexes(database)
+    create_indexes(database, 'air_temperatures', 'links', 'parcels')
+
+    log.info('Writing source file manifest.')
+    database.write_manifest('daymet', entries)
+    database.write_manifest('daymet_network', 
+        fingerprint_network(database, 'air_temperature'))
 
-    log.info('Writing process metadata.')
+    log.info('Refreshing network snapshot.')
+    write_snapshot(database)
     
 
 def main():
@@ -496,6 +404,9 @@ def main():
     parser.add_argument('--level', type=str, dest='level', default='info',
         choices=('notset', 'debug', 'info', 'warning', 'error', 'critical'),
         help='verbosity of the process log')
+    parser.add_argument('--update', dest='update', action='store_true', 
+        default=False, help='skip parsing if the daymet files and settings '
+        'are unchanged since the last run')
 
     args = parser.parse_args()
 
@@ -513,7 +424,7 @@ def main():
     home = path('')
 
     config = ConfigUtil.load_config(path('config.json'))
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'temperature')
 
     tmin_files = config['network']['exposure']['tmin_files']
     tmax_files = config['network']['exposure']['tmax_files']
@@ -527,7 +438,7 @@ def main():
         log.error('Process dependencies not met; see warnings and '
             'docuemntation for more details.')
         exit(1)
-    if complete(database):
+    if not args.update and complete(database):
         log.info('All or some of this process is already complete. '
             ' Would you like to proceed? [Y/n]')
         valid = ('y', 'n', 'yes', 'no', 'yee', 'naw')
@@ -541,8 +452,9 @@ def main():
 
     try:
         log.info('Starting road parsing.')
-        parse_temperatures(database, tmin_files, tmax_files, 
-            steps, day, 4326, 2223)
+        with database.bulk_load():
+            parse_temperatures(database, tmin_files, tmax_files, 
+                steps, day, 4326, 2223, args.update)
     except:
         log.exception('Critical error while parsing roads; '
             'terminating process and exiting.')
@@ -4,7 +4,7 @@ import logging as log
 from argparse import ArgumentParser
 
 from icarus.parse.events.events import Events
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import open_database
 from icarus.util.config import ConfigUtil
 
 parser = ArgumentParser()
@@ -33,7 +33,7 @@ planspath = path('output/output_plans.xml.gz')
 log.info('Running events parsing tool.')
 log.info(f'Loading run data from {home}.')
 
-database = SqliteUtil(path('database.db'))
+database = open_database(home, 'output')
 events = Events(database)
 
 if not events.ready(eventspath, planspath):
@@ -47,7 +47,8 @@ elif events.complete():
 
 try:
     log.info('Starting events parsing.')
-    events.parse(planspath, eventspath)
+    with database.bulk_load():
+        events.parse(planspath, eventspath)
 except:
     log.exception('Critical error while parsing events; '
         'terminating process and exiting.')
@@ -7,6 +7,7 @@ from icarus.parse.events.activity import Activity
 from icarus.parse.events.leg import Leg
 from icarus.parse.events.population import Population
 from icarus.util.sqlite import SqliteUtil
+from icarus.util.indexes import create_indexes
 from icarus.util.general import defaultdict, counter
 from icarus.util.file import multiopen, exists
 
@@ -73,45 +74,6 @@ class Events:
         self.database.connection.commit()
 
     
-    def create_indexes(self):
-        query = '''
-            CREATE INDEX output_agents_agent 
-            ON output_agents(agent_id);'''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_activities_agent
-            ON output_activities(agent_id, agent_idx);'''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_activities_activity
-            ON output_activities(activity_id);'''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_legs_agent 
-            ON output_legs(agent_id, agent_idx);'''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_legs_leg
-            ON output_legs(leg_id);'''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_events_event
-            ON output_events(event_id)
-        '''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_events_link
-            ON output_events(link_id)
-        '''
-        self.database.cursor.execute(query)
-        query = '''
-            CREATE INDEX output_events_leg
-            ON output_events(leg_id, leg_idx)
-        '''
-        self.database.cursor.execute(query)
-        self.database.connection.commit()
-
-    
     def fetch_legs(self):
         query = '''
             SELECT
@@ -242,4 +204,5 @@ class Events:
         self.database.insert_values('output_legs', legs, 8)
 
         log.info('Creating indexes on new tables.')
-        self.create_indexes()
+        create_indexes(self.database, 'output_agents', 'output_activities',
+            'output_legs', 'output_events')
@@ -10,14 +10,11 @@ from icarus.parse.events.route import Route
 from icarus.parse.events.types import NetworkMode, LegMode
 from icarus.parse.events.agent import Agent
 from icarus.util.sqlite import SqliteUtil
+from icarus.util.snapshot import NetworkSnapshot, load_snapshot
 from icarus.util.general import counter, defaultdict
 from icarus.util.file import multiopen
 
 
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
-
-
 class Network:
     __slots__ = ('database', 'nodes', 'links', 'routes', 'agents')
 
@@ -28,51 +25,32 @@ class Network:
         self.agents = defaultdict(lambda uuid: Agent(uuid))
 
     
-    def fetch_nodes(self) -> List[List]:
-        self.database.cursor.execute('''
-            SELECT
-                node_id,
-                maz,
-                point
-            FROM nodes; ''')
-        return self.database.cursor.fetchall()
-
-
-    def fetch_links(self) -> List[List]:
-        self.database.cursor.execute('''
-            SELECT
-                link_id,
-                source_node,
-                terminal_node,
-                length,
-                freespeed,
-                modes
-            FROM links; ''')
-        return self.database.cursor.fetchall()
-
-
-    def load_nodes(self):
+    def load_nodes(self, network: NetworkSnapshot):
         log.info('Loading network road node data.')
-        nodes = counter(self.fetch_nodes(), 'Loading node %s.')
-        for node in nodes:
-            node_id = node[0]
-            maz = node[1]
-            x, y = xy(node[2])
+        rows = zip(network.node_ids.tolist(), network.node_maz.tolist(),
+            network.node_x.tolist(), network.node_y.tolist())
+        nodes = counter(rows, 'Loading node %s.')
+        for node_id, maz, x, y in nodes:
+            maz = None if maz < 0 else maz
             self.nodes[node_id] = Node(node_id, maz, x, y)
 
 
-    def load_links(self):
-        log.info('Fetching network road link data.')
-        links = counter(self.fetch_links(), 'Loading link %s.')
-        for link in links:
-            link_id = link[0]
-            src_node = self.nodes[link[1]]
-            term_node = self.nodes[link[2]]
-            length = link[3]
-            freespeed = link[4]
-            modes = set(NetworkMode(mode) for mode in link[5].split(','))
+    def load_links(self, network: NetworkSnapshot):
+        log.info('Loading network road link data.')
+        node_ids = network.node_ids.tolist()
+        modes = {}
+        rows = zip(network.link_ids.tolist(), network.link_source.tolist(),
+            network.link_terminal.tolist(), network.link_length.tolist(),
+            network.link_freespeed.tolist(), network.link_modes.tolist())
+        links = counter(rows, 'Loading link %s.')
+        for link_id, src, term, length, freespeed, mask in links:
+            src_node = self.nodes[node_ids[src]]
+            term_node = self.nodes[node_ids[term]]
+            if mask not in modes:
+                modes[mask] = set(NetworkMode(mode) 
+                    for mode in network.decode_modes(mask))
             self.links[link_id] = Link(link_id, src_node, term_node, 
-                length, freespeed, modes)
+                length, freespeed, modes[mask])
 
         
     def load_routes(self, planspath: str):
@@ -125,7 +103,8 @@ class Network:
     
     def load_network(self, planspath: str):
         log.info('Loading network data.')
-        self.load_nodes()
-        self.load_links()
+        network = load_snapshot(self.database)
+        self.load_nodes(network)
+        self.load_links(network)
         self.load_routes(planspath)
 
@@ -5,64 +5,28 @@ import os
 import csv
 import logging as log
 
+import numpy as np
+import pandas as pd
+import shapely
+
 from glob import glob
-from math import sqrt
-from typing import List, Dict, FrozenSet, Tuple
+from typing import List, Tuple
 from argparse import ArgumentParser, SUPPRESS
 from pyproj.transformer import Transformer
 from rtree.index import Index
+from scipy.sparse import csr_matrix
 
-from icarus.util.general import counter
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.general import pmap
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes, drop_indexes
 from icarus.util.config import ConfigUtil
-
-
-class Point:
-    __slots__ = ('id', 'x', 'y', 'mrt', 'pet', 'utci')
-
-    def __init__(self, uuid: int, x: float, y: float, mrt: float, 
-            pet: float, utci: float):
-        self.id = uuid
-        self.x = x
-        self.y = y
-        self.mrt = mrt
-        self.pet = pet
-        self.utci = utci
-
-    def entry(self):
-        return (self.id, (self.x, self.y, self.x, self.y), None)
-
-
-class Link:
-    __slots__ = ('id', 'source_node', 'terminal_node', 'lanes', 'freespeed',
-            'profile')
-
-    def __init__(self, uuid: str, source_node: Node, terminal_node: Node, 
-            lanes: float, freespeed: float):
-        self.id = uuid
-        self.source_node = source_node
-        self.terminal_node = terminal_node
-        self.lanes = lanes
-        self.freespeed = freespeed
-        self.profile = None
-
-
-    def bounds(self, buffer: float = 0):
-        xmin = min(self.source_node.x, self.terminal_node.x) - buffer
-        xmax = max(self.source_node.x, self.terminal_node.x) + buffer
-        ymin = min(self.source_node.y, self.terminal_node.y) - buffer
-        ymax = max(self.source_node.y, self.terminal_node.y) + buffer
-        
-        return (xmin, ymin, xmax, ymax)
-
-
-class Node:
-    __slots__ = ('id', 'maz', 'x', 'y')
-
-    def __init__(self, uuid: str, x: float, y: float):
-        self.id = uuid
-        self.x = x
-        self.y = y
+from icarus.util.file import fingerprint
+from icarus.util.geometry import load_polygons
+from icarus.util.hashing import splitmix64
+from icarus.util.snapshot import load_snapshot, write_snapshot, \
+    fingerprint_network
+from icarus.util.spatial import index_path, load_index, point_bounds, \
+    intersection, nearest, contains
 
 
 def null_count(database: SqliteUtil, table: str, col: str):
@@ -92,24 +56,21 @@ def null_count(database: SqliteUtil, table: str, col: str):
 
 def complete(database: SqliteUtil):
     null, nnull = null_count(database, 'links', 'mrt_temperature')
-    # null, nnull = null_count(database, 'parcels', 'mrt_temperature')
+    null, nnull = null_count(database, 'parcels', 'mrt_temperature')
 
 
 def ready():
     pass
 
 
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
-
-
 def hhmm_to_secs(hhmm: str) -> int:
     hrs, mins, ampm = hhmm.upper().replace(' ', ':').split(':')
     return (int(hrs) % 12) * 3600 + int(mins) * 60 + (ampm == 'PM') * 43200
 
 
 def create_tables(database: SqliteUtil):
-    database.drop_table('mrt_temperatures', 'temp_links', 'temp_links_merged')
+    database.drop_table('mrt_temperatures', 'mrt_profiles', 'temp_links', 
+        'temp_parcels')
     query = '''
         CREATE TABLE mrt_temperatures(
             temperature_id MEDIUMINT UNSIGNED,
@@ -122,324 +83,439 @@ def create_tables(database: SqliteUtil):
     '''
     database.cursor.execute(query)
     query = '''
-        CREATE TABLE temp_links(
-            link_id VARCHAR(255),
-            mrt_temperature MEDIUMINT UNSIGNED
+        CREATE TABLE mrt_profiles(
+            temperature_id MEDIUMINT UNSIGNED,
+            point_idx INT UNSIGNED
         );
     '''
     database.cursor.execute(query)
-    database.connection.commit()
-
-
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE INDEX mrt_temperatures_temperature
-        ON mrt_temperatures(temperature_id, temperature_idx); 
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_link
-        ON links(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node1
-        ON links(source_node);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node2
-        ON links(terminal_node);
-    '''
-    database.cursor.execute(query)
     query = '''
-        CREATE INDEX links_air
-        ON links(air_temperature);
+        CREATE TABLE temp_links(
+            link_id VARCHAR(255),
+            mrt_temperature MEDIUMINT UNSIGNED
+        );
     '''
     database.cursor.execute(query)
     query = '''
-        CREATE INDEX links_mrt
-        ON links(mrt_temperature);
+        CREATE TABLE temp_parcels(
+            apn VARCHAR(255),
+            mrt_temperature MEDIUMINT UNSIGNED
+        );
     '''
     database.cursor.execute(query)
-    # query = '''
-    #     CREATE INDEX parcels_apn
-    #     ON parcels(apn);
-    # '''
-    # database.cursor.execute(query)
-    # query = '''
-    #     CREATE INDEX parcels_maz
-    #     ON parcels(maz);
-    # '''
-    # database.cursor.execute(query)
-    # query = '''
-    #     CREATE INDEX parcels_air
-    #     ON parcels(air_temperature);
-    # '''
-    # database.cursor.execute(query)
-    # query = '''
-    #     CREATE INDEX parcels_mrt
-    #     ON parcels(mrt_temperature);
-    # '''
-    # database.cursor.execute(query)
     database.connection.commit()
 
 
-
-def load_nodes(database: SqliteUtil) -> Dict[str,Node]:
+def load_parcels(database: SqliteUtil) -> Tuple[List[str],np.ndarray]:
     query = '''
         SELECT
-            node_id,
-            point
-        FROM nodes;
-    '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
-    rows = counter(rows, 'Loading node %s.')
-
-    nodes: Dict[str,Node] = {}
-    for uuid, point in rows:
-        x, y = xy(point)
-        node = Node(uuid, x, y)
-        nodes[uuid] = node
-    
-    return nodes
-
-
-def load_links(database: SqliteUtil, nodes: Dict[str,Node]) -> Dict[str,Link]:
-    query = '''
-        SELECT
-            link_id,
-            source_node,
-            terminal_node,
-            freespeed,
-            permlanes
-        FROM links;
+            apn,
+            CASE 
+                WHEN cooling
+                THEN NULL ELSE region
+                END AS outdoor
+        FROM parcels;
     '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
-    rows = counter(rows, 'Loading link %s.')
+    return load_polygons(database, query)
 
-    links: Dict[str,Link] = {}
-    for uuid, src, term, speed, lanes in rows:
-        source_node = nodes[src]
-        terminal_node = nodes[term]
-        link = Link(uuid, source_node, terminal_node, lanes, speed)
-        links[uuid] = link
 
-    return links
+def parse_time(csvfile: str) -> int:
+    with open(csvfile, 'r') as csv_file:
+        rows = csv.reader(csv_file, delimiter=',', quotechar='"')
+        next(rows)
+        secs = hhmm_to_secs(next(rows)[2])
+    return secs
 
 
 def parse_points(csvfile: str, src_epsg: int, prj_epsg: int) \
-            -> Tuple[List[Point],int]:
+            -> Tuple[np.ndarray,np.ndarray,int]:
     log.info(f'Opening {csvfile}.')
-    csv_file = open(csvfile, 'r')
-    iter_points = csv.reader(csv_file, delimiter=',', quotechar='"')
-    next(iter_points)
-    iter_points = counter(iter_points, 'Parsing point %s.')
+    secs = parse_time(csvfile)
+    frame = pd.read_csv(csvfile, usecols=(0, 1, 3, 4, 5), 
+        dtype=np.float64, quotechar='"')
+    log.info(f'Parsed {len(frame)} points.')
 
     transformer = Transformer.from_crs(f'epsg:{src_epsg}', 
         f'epsg:{prj_epsg}', always_xy=True, skip_equivalent=True)
-    project = transformer.transform
-
-    points = []
-    peek = next(iter_points)
-    iter_points.send(peek)
-    secs = hhmm_to_secs(peek[2])
-    for uuid, (lat, lon, _, mrt, pet, utci) in enumerate(iter_points):
-        x, y = project(lon, lat)
-        point = Point(uuid, x, y, float(mrt), float(pet), float(utci))
-        points.append(point)
 
-    csv_file.close()
+    data = frame.to_numpy()
+    x, y = transformer.transform(data[:,1], data[:,0])
+    points = np.column_stack((x, y))
+    values = np.ascontiguousarray(data[:,2:5])
 
-    return points, secs
+    return points, values, secs
 
 
-def parse_temperatures(csvfile: str) \
-            -> Tuple[List[Tuple[float,float,float]],int]:
+def parse_temperatures(csvfile: str) -> Tuple[np.ndarray,int]:
     log.info(f'Opening {csvfile}.')
-    csv_file = open(csvfile, 'r')
-    iter_temps = csv.reader(csv_file, delimiter=',', quotechar='"')
-    next(iter_temps)
-    iter_temps = counter(iter_temps, 'Parsing temperature %s.')
+    secs = parse_time(csvfile)
+    frame = pd.read_csv(csvfile, usecols=(3, 4, 5), 
+        dtype=np.float64, quotechar='"')
+    log.info(f'Parsed {len(frame)} temperatures.')
 
-    temps = []
-    peek = next(iter_temps)
-    iter_temps.send(peek)
-    secs = hhmm_to_secs(peek[2])
-    for _, _, _, mrt, pet, utci in iter_temps:
-        temps.append((float(mrt), float(pet), float(utci)))
-        
-    csv_file.close()
+    return frame.to_numpy(), secs
 
-    return temps, secs
+
+operator: csr_matrix = None
+
+
+def initialize_operator(profiles: csr_matrix):
+    global operator
+    operator = profiles
+
+
+def average_temperatures(csvfile: str) -> Tuple[int,np.ndarray]:
+    temperatures, time = parse_temperatures(csvfile)
+    if len(temperatures) != operator.shape[1]:
+        log.error(f'Found {len(temperatures)} temperatures in {csvfile} '
+            f'but expected {operator.shape[1]} points; quiting to '
+            'prevent misaligned profiles.')
+        raise RuntimeError
+
+    return time, operator @ temperatures
+
+
+def profile_operator(indptr: np.ndarray, indices: np.ndarray, 
+        size: int) -> csr_matrix:
+    counts = np.diff(indptr)
+    weights = np.repeat(1 / np.maximum(counts, 1), counts)
+    return csr_matrix((weights, indices, indptr), 
+        shape=(len(counts), size))
+
+
+def segment_distances(sources: np.ndarray, terminals: np.ndarray, 
+        points: np.ndarray) -> np.ndarray:
+    segments = terminals - sources
+    offsets = points - sources
+    norms = np.einsum('ij,ij->i', segments, segments)
+    dots = np.einsum('ij,ij->i', offsets, segments)
+    scale = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+    np.clip(scale, 0, 1, out=scale)
+    diffs = offsets - scale[:,None] * segments
+    return np.hypot(diffs[:,0], diffs[:,1])
+
+
+def match_links(index: Index, sources: np.ndarray, terminals: np.ndarray, 
+        points: np.ndarray, bounds: float, batch: int = 100000) \
+            -> Tuple[np.ndarray,np.ndarray]:
+    link_pairs = []
+    point_pairs = []
+    for low in range(0, len(sources), batch):
+        high = min(low + batch, len(sources))
+        log.info(f'Matching links {low} to {high} with nearby MRT points.')
+        src = sources[low:high]
+        term = terminals[low:high]
+
+        extents = np.hstack((np.minimum(src, term) - bounds, 
+            np.maximum(src, term) + bounds))
+        local, nearby = intersection(index, extents)
+
+        dists = segment_distances(src[local], term[local], points[nearby])
+        keep = dists <= bounds
+        local = local[keep]
+        nearby = nearby[keep]
+
+        order = np.lexsort((nearby, local))
+        link_pairs.append(local[order] + low)
+        point_pairs.append(nearby[order])
+
+    if len(link_pairs):
+        link_pairs = np.concatenate(link_pairs)
+        point_pairs = np.concatenate(point_pairs)
+    else:
+        link_pairs = np.zeros(0, dtype=np.int64)
+        point_pairs = np.zeros(0, dtype=np.int64)
+
+    return link_pairs, point_pairs
+
+
+def match_parcels(index: Index, polygons: np.ndarray, points: np.ndarray, 
+        bounds: float, neighbors: int) -> Tuple[np.ndarray,np.ndarray]:
+    parcel_pairs, point_pairs = contains(index, polygons, points)
+
+    # parcels without an mrt point inside of them fall back to the nearest
+    # points within bounds of their extent
+    empty = np.ones(len(polygons), dtype=bool)
+    empty[parcel_pairs] = False
+    empty = np.flatnonzero(empty)
+    if len(empty):
+        dists = np.full(len(empty), bounds, dtype=np.float64)
+        local, nearby = nearest(index, shapely.bounds(polygons[empty]), 
+            neighbors, dists)
+        parcel_pairs = np.concatenate((parcel_pairs, empty[local]))
+        point_pairs = np.concatenate((point_pairs, nearby))
+
+    order = np.lexsort((point_pairs, parcel_pairs))
+    return parcel_pairs[order], point_pairs[order]
+
+
+def group_profiles(link_pairs: np.ndarray, point_pairs: np.ndarray, 
+        size: int) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+    profiles = np.full(size, -1, dtype=np.int64)
+    counts = np.bincount(link_pairs, minlength=size)
+    matched = np.flatnonzero(counts)
+    if not len(matched):
+        return profiles, np.zeros(1, dtype=np.int64), point_pairs
+
+    counts = counts[matched]
+    starts = np.cumsum(counts) - counts
+
+    # each set of points is keyed by its size and two order independent
+    # 64 bit hashes, so identical sets collapse without leaving numpy
+    keys = np.empty((len(matched), 3), dtype=np.uint64)
+    keys[:,0] = counts
+    keys[:,1] = np.add.reduceat(splitmix64(point_pairs, 0), starts)
+    keys[:,2] = np.bitwise_xor.reduceat(splitmix64(point_pairs), starts)
+    _, first, inverse = np.unique(keys, axis=0, 
+        return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    profiles[matched] = rank[inverse]
+
+    members = first[order]
+    sizes = counts[members]
+    indptr = np.zeros(len(members) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=indptr[1:])
+    offsets = np.repeat(starts[members] - indptr[:-1], sizes)
+    indices = point_pairs[np.arange(indptr[-1]) + offsets]
+
+    return profiles, indptr, indices
+
+
+def load_profiles(database: SqliteUtil) -> Tuple[np.ndarray,np.ndarray]:
+    query = '''
+        SELECT
+            temperature_id,
+            point_idx
+        FROM mrt_profiles
+        ORDER BY
+            temperature_id,
+            point_idx;
+    '''
+    batches = list(database.fetch_batches(query, dtypes=(np.int64, np.int64)))
+    uuids = np.concatenate([batch.temperature_id for batch in batches]) \
+        if len(batches) else np.zeros(0, dtype=np.int64)
+    points = np.concatenate([batch.point_idx for batch in batches]) \
+        if len(batches) else np.zeros(0, dtype=np.int64)
+    counts = np.bincount(uuids)
+    indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    return indptr, points
+
+
+def update_mrt(database: SqliteUtil, csvfiles: List[str], steps: int, 
+        workers: int) -> bool:
+    manifest = database.fetch_manifest('mrt')
+    tables = ('mrt_temperatures', 'mrt_profiles')
+    if len(database.table_exists(*tables)) < len(tables):
+        log.info('No existing MRT profiles found to update.')
+        return False
+
+    layouts = database.fetch_manifest('mrt_layout')
+    if not len(layouts) or list(layouts)[0] not in csvfiles:
+        log.info('Profile defining MRT file is missing; rebuilding profiles.')
+        return False
+    layout = list(layouts)[0]
+    if fingerprint(layout, layouts[layout][1:4])[2] != layouts[layout][3]:
+        log.info('Profile defining MRT file has changed; rebuilding profiles.')
+        return False
+    network = database.fetch_manifest('mrt_network')
+    if network != fingerprint_network(database, 'mrt_temperature'):
+        log.info('Links or parcels changed since the last run; rebuilding '
+            'profiles.')
+        return False
+
+    entries = {}
+    changed = []
+    stale = set()
+    for csvfile in csvfiles:
+        if csvfile == layout:
+            continue
+        entry = manifest.get(csvfile)
+        previous = None if entry is None else entry[1:4]
+        size, mtime, digest = fingerprint(csvfile, previous)
+        if entry is not None and digest == entry[3]:
+            entries[csvfile] = ('timestep', size, mtime, digest, entry[4])
+        else:
+            changed.append((csvfile, size, mtime, digest))
+            if entry is not None:
+                stale.add(entry[4])
+    for path, entry in manifest.items():
+        if path not in csvfiles:
+            stale.add(entry[4])
+    
+    log.info(f'Found {len(changed)} new or changed and {len(stale)} stale '
+        f'MRT files out of {len(csvfiles)}.')
+
+    log.info('Loading existing MRT profiles.')
+    indptr, indices = load_profiles(database)
+    profile_averages = profile_operator(indptr, indices, layouts[layout][4])
+
+    drop_indexes(database, 'mrt_temperatures')
+    for idx in stale:
+        database.cursor.execute('DELETE FROM mrt_temperatures '
+            'WHERE temperature_idx = ?;', (idx,))
+
+    results = pmap(average_temperatures, (entry[0] for entry in changed), 
+        workers, initialize_operator, (profile_averages,))
+    for (csvfile, size, mtime, digest), (time, averages) in \
+            zip(changed, results):
+        idx = time // (86400 // steps)
+        log.info('Splicing temperature data into database.')
+        database.cursor.execute('DELETE FROM mrt_temperatures '
+            'WHERE temperature_idx = ?;', (idx,))
+        database.insert_values('mrt_temperatures',
+            ((uuid, idx, time, *values) for uuid, values 
+                in enumerate(averages.tolist())), 6)
+        entries[csvfile] = ('timestep', size, mtime, digest, idx)
+        database.connection.commit()
+
+    database.write_manifest('mrt', entries)
+
+    log.info('Rebuilding indexes on updated tables.')
+    create_indexes(database, 'mrt_temperatures')
+
+    return True
 
 
 def parse_mrt(database: SqliteUtil, path: str, src_epsg: int, prj_epsg: int,
-        bounds:int = 30, steps: int = 96):
+        bounds:int = 30, steps: int = 96, neighbors: int = 4, 
+        workers: int = 1, update: bool = False):
+    log.info(f'Searching for mrt files in {path}')
+    csvfiles = glob(f'{path}/**/*.csv', recursive=True)
+    csvfiles.sort(key=parse_time)
+
+    if update:
+        log.info('Checking MRT files against the source manifest.')
+        if update_mrt(database, csvfiles, steps, workers):
+            return
+
     log.info('Allocating tables for MRT temperature profiles.')
     create_tables(database)
 
-    log.info('Loading network nodes from database.')
-    nodes: Dict[str,Node]
-    nodes = load_nodes(database)
+    log.info('Loading network nodes and links from snapshot.')
+    network = load_snapshot(database)
+    coords = network.node_coords()
+    links = network.link_ids
+    source_nodes = network.link_source
+    terminal_nodes = network.link_terminal
 
-    log.info('Loading network links from database.')
-    links: Dict[str,Link] 
-    links= load_links(database, nodes)
-
-    log.info(f'Searching for mrt files in {path}')
-    csvfiles = iter(glob(f'{path}/**/*.csv', recursive=True))
+    log.info('Loading network parcels from database.')
+    parcels: List[str]
+    polygons: np.ndarray
+    parcels, polygons = load_parcels(database)
+    outdoor = np.flatnonzero(~shapely.is_missing(polygons))
 
     log.info('Handling initial dataset for profile construction.')
-    points: List[Point]
+    points: np.ndarray
+    values: np.ndarray
     time: int 
-    points, time = parse_points(next(csvfiles), src_epsg, prj_epsg)
-    
-    log.info('Building spatial index on MRT points.')
-    index = Index((point.entry() for point in points))
-
-    log.info('Scanning link bounds and building profiles.')
-    mapping: Dict[FrozenSet[int],int] = {}
-    count = 0
-    empty = 0
-    iter_links = counter(links.values(), 'Scanning link %s.')
-    for link in iter_links:
-        d = link.terminal_node.x * link.source_node.y - \
-            link.source_node.x * link.terminal_node.y
-        dx = link.terminal_node.x - link.source_node.x
-        dy = link.terminal_node.y - link.source_node.y
-        l = sqrt(dy * dy + dx * dx)
-
-        nearby = index.intersection(link.bounds(bounds))
-        contained = []
-        for uuid in nearby:
-            point = points[uuid]
-            x = point.x
-            y = point.y
-            if l > 0:
-                dist = abs(dy * x - dx * y + d ) / l
-            else:
-                px = point.x - link.source_node.x
-                py = point.y - link.source_node.y
-                dist = sqrt(px * px + py * py)
-            if dist <= bounds:
-                contained.append(point.id)
-        
-        if contained:
-            profile = frozenset(contained)
-            if profile in mapping:
-                link.profile = mapping[profile]
-            else:
-                mapping[profile] = count
-                link.profile = count
-                count += 1
-        else:
-            empty += 1
+    layout = csvfiles[0]
+    points, values, time = parse_points(layout, src_epsg, prj_epsg)
+    layouts = {layout: ('layout', *fingerprint(layout), len(points))}
+    entries = {}
 
-    profiles: List[Tuple[int]]
-    profiles = [tuple(key) for key in mapping.keys()]
+    log.info('Loading spatial index on MRT points.')
+    index = load_index(index_path(database, 'mrt'), point_bounds(points))
 
+    log.info('Scanning link bounds and building profiles.')
+    link_pairs, point_pairs = match_links(index, coords[source_nodes], 
+        coords[terminal_nodes], points, bounds)
+
+    log.info(f'Joining {len(outdoor)} outdoor parcels with MRT points.')
+    parcel_pairs, parcel_points = match_parcels(index, polygons[outdoor], 
+        points, bounds, neighbors)
+
+    owners = np.concatenate((link_pairs, parcel_pairs + len(links)))
+    members = np.concatenate((point_pairs, parcel_points))
+    profiles, indptr, indices = group_profiles(owners, members, 
+        len(links) + len(outdoor))
+    link_profiles = profiles[:len(links)]
+    parcel_profiles = np.full(len(parcels), -1, dtype=np.int64)
+    parcel_profiles[outdoor] = profiles[len(links):]
+
+    empty = np.count_nonzero(link_profiles < 0)
     if empty:
         log.warning(f'Found {empty} links without any MRT temperature profile.')
+    empty = np.count_nonzero(parcel_profiles[outdoor] < 0)
+    if empty:
+        log.warning(f'Found {empty} outdoor parcels without any MRT '
+            'temperature profile.')
 
-    def dump_points():
+    log.info('Building profile averaging operator.')
+    profile_averages = profile_operator(indptr, indices, len(points))
+
+    def dump_temperatures(time: int, averages: np.ndarray):
         idx = time // (86400 // steps)
-        for uuid, profile in enumerate(profiles):
-            mrt, pet, utci = 0, 0, 0
-            count = len(profile)
-            for ptid in profile:
-                point = points[ptid]
-                mrt += point.mrt
-                pet += point.pet
-                utci += point.utci
-            yield (uuid, idx, time, mrt / count, pet / count, utci / count)
+        for uuid, (mrt, pet, utci) in enumerate(averages.tolist()):
+            yield (uuid, idx, time, mrt, pet, utci)
 
     def dump_links():
-        for link in links.values():
-            yield (link.id, link.profile)
-
-    log.info('Writing link updates and temperatures to dataabse.')
-
-    database.insert_values('mrt_temperatures', dump_points(), 6)
-    database.insert_values('temp_links', dump_links(), 2)
+        for link, profile in zip(links.tolist(), link_profiles.tolist()):
+            yield (link, profile if profile >= 0 else None)
 
-    log.info('Merging, dropping and renaming old tables.')
+    def dump_parcels():
+        for apn, profile in zip(parcels, parcel_profiles.tolist()):
+            yield (apn, profile if profile >= 0 else None)
 
-    query = '''
-        CREATE INDEX temp_links_link
-        ON temp_links(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE TABLE temp_links_merged
-        AS SELECT
-            links.link_id,
-            links.source_node,
-            links.terminal_node,
-            links.length,
-            links.freespeed,
-            links.capacity,
-            links.permlanes,
-            links.oneway,
-            links.modes,
-            links.air_temperature,
-            temp_links.mrt_temperature
-        FROM links
-        INNER JOIN temp_links
-        USING(link_id);
-    '''
-    database.cursor.execute(query)
+    def dump_profiles():
+        for uuid in range(len(indptr) - 1):
+            for point in indices[indptr[uuid]:indptr[uuid+1]].tolist():
+                yield (uuid, point)
 
-    original = database.count_rows('links')
-    merged = database.count_rows('temp_links_merged')
-    if original != merged:
-        log.error('Original links and updated links tables '
-            'do not align; quiting to prevent data loss.')
-        raise RuntimeError
-    
-    database.drop_table('links', 'temp_links')
-    query = '''
-        ALTER TABLE temp_links_merged
-        RENAME TO links;
-    '''
-    database.cursor.execute(query)
+    log.info('Writing link updates and temperatures to dataabse.')
 
+    database.insert_values('mrt_temperatures', 
+        dump_temperatures(time, profile_averages @ values), 6)
+    database.insert_values('temp_links', dump_links(), 2)
+    database.insert_values('temp_parcels', dump_parcels(), 2)
+    database.insert_values('mrt_profiles', dump_profiles(), 2)
+
+    log.info('Patching MRT temperatures into links and parcels.')
+    drop_indexes(database, 'links', 'parcels')
+    database.patch_column('links', 'link_id', 'mrt_temperature', 'temp_links')
+    database.patch_column('parcels', 'apn', 'mrt_temperature', 'temp_parcels')
+    database.drop_table('temp_links', 'temp_parcels')
     database.connection.commit()
 
     del links
-    del nodes
+    del network
+    del coords
+    del parcels
+    del polygons
     del index
-    del mapping
+    del profiles
     del points
+    del values
 
     log.info('Handling remain temperatures with defined profile.')
 
-    def dump_temperaures(time: int, temperatures: List[Tuple[float,float,float]]):
-        idx = time // (86400 // steps)
-        for uuid, profile in enumerate(profiles):
-            mrt, pet, utci = 0, 0, 0
-            count = len(profile)
-            for tempid in profile:
-                temp = temperatures[tempid]
-                mrt += temp[0]
-                pet += temp[1]
-                utci += temp[2]
-            yield (uuid, idx, time, mrt / count, pet / count, utci / count)
-
-    for csvfile in csvfiles:
-        time: int
-        temperatures: List[Tuple[float,float,float]]
-        temperatures, time = parse_temperatures(csvfile)
-
+    results = pmap(average_temperatures, csvfiles[1:], workers, 
+        initialize_operator, (profile_averages,))
+    for csvfile, (time, averages) in zip(csvfiles[1:], results):
         log.info('Writing temperature data to database.')
         database.insert_values('mrt_temperatures', 
-            dump_temperaures(time, temperatures), 6)
+            dump_temperatures(time, averages), 6)
         database.connection.commit()
+        idx = time // (86400 // steps)
+        entries[csvfile] = ('timestep', *fingerprint(csvfile), idx)
+
+    log.info('Writing source file manifest.')
+    database.write_manifest('mrt_layout', layouts)
+    database.write_manifest('mrt', entries)
+    database.write_manifest('mrt_network', 
+        fingerprint_network(database, 'mrt_temperature'))
 
     log.info('Creating indexes on new/updated tables.')
-    create_indexes(database)
+    create_indexes(database, 'mrt_temperatures', 'mrt_profiles',
+        'links', 'parcels')
+
+    log.info('Refreshing network snapshot.')
+    write_snapshot(database)
 
 
 def main():
@@ -454,6 +530,9 @@ def main():
     parser.add_argument('--level', type=str, dest='level', default='info',
         choices=('notset', 'debug', 'info', 'warning', 'error', 'critical'),
         help='verbosity of the process log')
+    parser.add_argument('--update', dest='update', action='store_true', 
+        default=False, help='only parse mrt files that are new or changed '
+        'since the last run')
 
     args = parser.parse_args()
 
@@ -474,20 +553,24 @@ def main():
     log.info(f'Loading run data from {home}.')
 
     config = ConfigUtil.load_config(path('config.json'))
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'temperature')
 
     path = config['network']['exposure']['mrt_dir']
+    workers = config['resources']['cores']
 
     try:
         log.info('Starting mrt temperature parsing.')
-        parse_mrt(
-            database, 
-            path, 
-            src_epsg=4326,
-            prj_epsg=2223, 
-            bounds=50,
-            steps=96
-        )
+        with database.bulk_load():
+            parse_mrt(
+                database, 
+                path, 
+                src_epsg=4326,
+                prj_epsg=2223, 
+                bounds=50,
+                steps=96,
+                workers=workers,
+                update=args.update
+            )
     except:
         log.exception('Critical error while running mrt temperature '
             'parsing; cleaning up and terminating.')
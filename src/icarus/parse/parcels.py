@@ -3,36 +3,26 @@ import os
 import csv
 import shapefile
 import logging as log
+import numpy as np
+import shapely
 
 from argparse import ArgumentParser
-from typing import Dict, Iterable, Tuple
+from typing import Dict, Tuple
 from pyproj.transformer import Transformer
 from rtree.index import Index
-from shapely.geometry import Point, Polygon
-from shapely.wkt import loads, dumps
 
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes
 from icarus.util.config import ConfigUtil
-from icarus.util.general import counter
+from icarus.util.general import counter, pmap
+from icarus.util.geometry import load_polygons, dump_polygons
+from icarus.util.spatial import memory_index, within
 
 
-class Region:
-    __slots__ = ('maz', 'polygon')
-
-    def __init__(self, maz: int, polygon: str):
-        self.maz = maz
-        self.polygon = Polygon(loads(polygon))
-
-
-class Parcel:
-    __slots__ = ('apn', 'kind', 'cooling', 'polygon', 'maz')
-
-    def __init__(self, apn: str, kind: str, cooling: bool, polygon: Polygon):
-        self.apn = apn
-        self.kind = kind
-        self.cooling = cooling
-        self.polygon = polygon
-        self.maz = None
+transformer: Transformer = None
+region_mazs: np.ndarray = None
+region_polygons: np.ndarray = None
+region_index: Index = None
 
 
 def complete(database: SqliteUtil):
@@ -72,71 +62,85 @@ def create_tables(database: SqliteUtil):
             cooling TINYINT UNSIGNED,
             air_temperature INT UNSIGNED,
             mrt_temperature INT UNSIGNED,
-            center VARCHAR(255),
-            region TEXT
+            x FLOAT,
+            y FLOAT,
+            region BLOB
         );
     '''
     database.cursor.execute(query)
     database.connection.commit()
 
 
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE INDEX parcels_apn
-        ON parcels(apn);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX parcels_maz
-        ON parcels(maz);
-    '''
-    database.cursor.execute(query)
-    database.connection.commit()
-
-
-def load_regions(database: SqliteUtil):
+def load_regions(database: SqliteUtil) -> Tuple[np.ndarray, np.ndarray]:
     query = '''
         SELECT
             maz,
             region
         FROM regions;
     '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
-    rows = counter(rows, 'Loading region %s.')
-
-    regions = []
-    for maz, polygon in rows:
-        region = Region(maz, polygon)
-        regions.append(region)
+    mazs, polygons = load_polygons(database, query)
 
-    return regions
+    return np.array(mazs), polygons
 
 
-def parse_parcels(database: SqliteUtil, residence_file: str, commerce_file:str, 
-        parcel_file: str, cooling_file: str, src_epsg: int, prj_epsg: int):
-    boundaries = {}
-    cooling = {}
-    parcels = []
-    apns = set()
-
+def initialize_worker(src_epsg: int, prj_epsg: int, mazs: np.ndarray, 
+        regions: np.ndarray):
+    global transformer, region_mazs, region_polygons, region_index
     transformer = Transformer.from_crs(f'epsg:{src_epsg}', 
         f'epsg:{prj_epsg}', always_xy=True, skip_equivalent=True)
-    project = transformer.transform
+    region_mazs = mazs
+    region_polygons = shapely.from_wkb(regions)
+    shapely.prepare(region_polygons)
+    region_index = memory_index(shapely.bounds(region_polygons))
 
-    log.info('Allocating tables for parcels.')
-    create_tables(database)
 
-    log.info('Parsing parcel boudaries from shapefile.')
-    parser = shapefile.Reader(parcel_file)
-    iter_boundaries = counter(iter(parser), 'Parsing parcel boundary %s.')
-    for parcel in iter_boundaries:
-        if len(parcel.shape.points):
-            apn = parcel.record['APN']
-            points = (project(*pt) for pt in parcel.shape.points)
-            polygon = Polygon(points)
-            boundaries[apn] = polygon
-    parser.close()
+def join_regions(centroids: np.ndarray, index: Index, regions: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    coords = shapely.get_coordinates(centroids)
+    parcel_idx, region_idx = within(index, coords, regions)
+
+    order = np.lexsort((region_idx, parcel_idx))
+    region_idx = region_idx[order]
+    parcel_idx = parcel_idx[order]
+    last = np.ones(len(parcel_idx), dtype=bool)
+    last[:-1] = parcel_idx[1:] != parcel_idx[:-1]
+    overlaps = np.flatnonzero(~last)
+    conflicts = np.stack((parcel_idx[overlaps], region_idx[overlaps], 
+        region_idx[overlaps+1]), axis=1)
+
+    joined = np.full(len(centroids), -1, dtype=np.int64)
+    joined[parcel_idx[last]] = region_idx[last]
+
+    return joined, conflicts
+
+
+def parse_batch(batch: Tuple[list, list, list, np.ndarray, np.ndarray]) \
+        -> Tuple[list, list]:
+    apns, kinds, cooling, coords, offsets = batch
+    x, y = transformer.transform(coords[:,0], coords[:,1])
+    indices = np.repeat(np.arange(len(apns)), np.diff(offsets))
+    rings = shapely.linearrings(np.stack((x, y), axis=1), indices=indices)
+    polygons = shapely.polygons(rings)
+    centroids = shapely.centroid(polygons)
+
+    joined, conflicts = join_regions(centroids, region_index, 
+        region_polygons)
+    mazs = [None if idx < 0 else int(region_mazs[idx]) for idx in joined]
+    conflicts = [(apns[parcel], int(region_mazs[region1]), 
+        int(region_mazs[region2])) for parcel, region1, region2 in conflicts]
+
+    x = shapely.get_x(centroids).tolist()
+    y = shapely.get_y(centroids).tolist()
+    rows = list(zip(apns, mazs, kinds, cooling, [None] * len(apns), 
+        [None] * len(apns), x, y, dump_polygons(polygons)))
+
+    return rows, conflicts
+
+
+def load_types(residence_file: str, commerce_file: str, cooling_file: str) \
+        -> Dict[str, Tuple[str, bool]]:
+    cooling = {}
+    types = {}
 
     log.info('Loading cooling information from csv file.')
     with open(cooling_file, 'r') as open_file:
@@ -147,87 +151,100 @@ def parse_parcels(database: SqliteUtil, residence_file: str, commerce_file:str,
     
     log.info('Parsing residential parcels from database file.')
     parser = shapefile.Reader(residence_file)
-    iter_parcels = counter(parser.iterRecords(), 'Parsing residential parcel %s.')
+    iter_parcels = counter(parser.iterRecords(fields=['APN']), 
+        'Parsing residential parcel %s.')
     for record in iter_parcels:
-        apn = record['APN']
-        if apn in boundaries and apn not in apn:
-            cool = True
-            polygon = boundaries[apn]
-            parcel = Parcel(apn, 'residential', cool, polygon)
-            parcels.append(parcel)
-            apns.add(apn)
+        types[record['APN']] = ('residential', True)
     parser.close()
     
     log.info('Parsing comercial parcels from database file.')
     parser = shapefile.Reader(commerce_file)
-    iter_parcels = counter(parser.iterRecords(), 'Parsing commercial parcel %s.')
+    iter_parcels = counter(parser.iterRecords(fields=['APN', 'DESCRIPT']), 
+        'Parsing commercial parcel %s.')
     for record in iter_parcels:
         apn = record['APN']
-        if apn in boundaries and apn not in apns:
-            desc = record['DESCRIPT']
-            cool = cooling[desc]
-            polygon = boundaries[apn]
-            parcel = Parcel(apn, 'commercial', cool, polygon)
-            parcels.append(parcel)
+        if apn not in types:
+            types[apn] = ('commercial', cooling[record['DESCRIPT']])
+    parser.close()
+
+    return types
+
+
+def iter_batches(parcel_file: str, types: Dict[str, Tuple[str, bool]], 
+        batch_size: int):
+    parser = shapefile.Reader(parcel_file)
+    shapes = counter(parser.iterShapeRecords(fields=['APN']), 
+        'Parsing parcel boundary %s.')
+    apns = set()
+    batch = []
+    for parcel in shapes:
+        apn = parcel.record['APN']
+        if len(parcel.shape.points) >= 3 and apn not in apns:
             apns.add(apn)
+            batch.append((apn, parcel.shape.points))
+            if len(batch) == batch_size:
+                yield pack_batch(batch, types)
+                batch = []
+    if len(batch):
+        yield pack_batch(batch, types)
     parser.close()
 
-    log.info('Parsing extraneous parcels from shapefile.')
-    other = set(boundaries.keys()) - apns
-    other = counter(other, 'Parsing extraneous parcel %s.')
-    for apn in other:
-        polygon = boundaries[apn]
-        parcel = Parcel(apn, 'other', True, polygon)
-        parcels.append(parcel)
-
-    def load():
-        for idx, parcel in enumerate(parcels):
-            pt = parcel.polygon.centroid
-            yield (idx, (pt.x, pt.y, pt.x, pt.y), None)
-    
-    log.info('Building spatial index from parcel data.')
-    index = Index(load())
+
+def pack_batch(batch: list, types: Dict[str, Tuple[str, bool]]):
+    apns = []
+    kinds = []
+    cooling = []
+    sizes = []
+    points = []
+    for apn, pts in batch:
+        kind, cool = types.get(apn, ('other', True))
+        apns.append(apn)
+        kinds.append(kind)
+        cooling.append(int(cool))
+        sizes.append(len(pts))
+        points.extend(pts)
+    coords = np.array(points, dtype=np.float64)
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+
+    return apns, kinds, cooling, coords, offsets
+
+
+def parse_parcels(database: SqliteUtil, residence_file: str, commerce_file:str, 
+        parcel_file: str, cooling_file: str, src_epsg: int, prj_epsg: int,
+        workers: int = 1, batch_size: int = 50000):
+    log.info('Allocating tables for parcels.')
+    create_tables(database)
+
+    types = load_types(residence_file, commerce_file, cooling_file)
 
     log.info('Loading network region data.')
-    regions = load_regions(database)
-
-    log.info('Scanning regions and mapping mazs to parcels.')
-    iter_regions = counter(regions, 'Sacnning region %s.')
-    for region in iter_regions:
-        apn = f'maz-{region.maz}'
-        parcel = Parcel(apn, 'default', True, region.polygon)
-        parcel.maz = region.maz
-        parcels.append(parcel)
-        result = index.intersection(region.polygon.bounds)
-        for idx in result:
-            parcel = parcels[idx]
-            if region.polygon.contains(parcel.polygon.centroid):
-                if parcel.maz is not None:
-                    warning = 'Parcel %s is in both region %s and %s' \
-                        '; the latter region will be kept.'
-                    log.warning(warning % (parcel.apn, parcel.maz, region.maz))
-                parcel.maz = region.maz
-    del regions
-
-    def dump():
-        for parcel in parcels:
-            yield (
-                parcel.apn,
-                parcel.maz,
-                parcel.kind,
-                int(parcel.cooling),
-                None,
-                None,
-                dumps(parcel.polygon.centroid),
-                dumps(parcel.polygon)
-            )
-
-    log.info('Writing parsed parcels to database.')
-    database.insert_values('parcels', dump(), 8)
+    mazs, regions = load_regions(database)
+
+    log.info('Parsing parcel boundaries from shapefile in batches.')
+    batches = iter_batches(parcel_file, types, batch_size)
+    results = pmap(parse_batch, batches, workers, initialize_worker,
+        (src_epsg, prj_epsg, mazs, shapely.to_wkb(regions)))
+    for rows, conflicts in results:
+        for apn, maz1, maz2 in conflicts:
+            log.warning('Parcel %s is in both region %s and %s; the latter '
+                'region will be kept.' % (apn, maz1, maz2))
+        database.insert_values('parcels', rows, 9)
+        database.connection.commit()
+    del types
+
+    log.info('Writing default parcels for maz regions.')
+    centroids = shapely.centroid(regions)
+    xs = shapely.get_x(centroids).tolist()
+    ys = shapely.get_y(centroids).tolist()
+    polygons = dump_polygons(regions)
+    rows = ((f'maz-{maz}', int(maz), 'default', 1, None, None, x, y, polygon) 
+        for maz, x, y, polygon in zip(mazs, xs, ys, polygons))
+    database.insert_values('parcels', rows, 9)
     database.connection.commit()
 
     log.info('Creating indexes on new tables.')
-    create_indexes(database)
+    create_indexes(database, 'parcels')
 
 
 def main():
@@ -260,12 +277,13 @@ def main():
     log.info(f'Loading run data from {home}.')
 
     config = ConfigUtil.load_config(path('config.json'))
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'network')
 
     residence_file = config['network']['parcels']['residence_file']
     commerce_file = config['network']['parcels']['commerce_file']
     parcel_file = config['network']['parcels']['parcel_file']
     cooling_file = config['network']['parcels']['type_file']
+    workers = config['resources']['cores']
 
     if not ready(database, residence_file, commerce_file, parcel_file):
         log.error('Process dependencies not met; see warnings and '
@@ -285,8 +303,9 @@ def main():
 
     try:
         log.info('Starting parcel parsing.')
-        parse_parcels(database, residence_file, commerce_file, 
-            parcel_file, cooling_file, 2223, 2223)
+        with database.bulk_load():
+            parse_parcels(database, residence_file, commerce_file, 
+                parcel_file, cooling_file, 2223, 2223, workers)
     except:
         log.exception('Critical error while parsing parcels; '
             'terminating process and exiting.')
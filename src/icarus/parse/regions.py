@@ -7,11 +7,12 @@ from argparse import ArgumentParser
 from rtree.index import Index
 from shapely.geometry import Polygon, Point
 from pyproj import Transformer
-from shapely.wkt import dumps
 
 from icarus.util.config import ConfigUtil
 from icarus.util.general import counter
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes
+from icarus.util.distances import drop_distances_table
 
 
 def complete(database: SqliteUtil):
@@ -36,28 +37,21 @@ def ready(regions_file: str):
 
 def create_tables(database: SqliteUtil):
     database.drop_table('regions')
+    drop_distances_table(database)
     query = '''
         CREATE TABLE regions(
             maz SMALLINT UNSIGNED,
             taz SMALLINT UNSIGNED,
             area FLOAT,
-            center VARCHAR(255),
-            region TEXT
+            x FLOAT,
+            y FLOAT,
+            region BLOB
         );  
     '''
     database.cursor.execute(query)
     database.connection.commit()
 
 
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE INDEX regions_maz
-        ON regions(maz); 
-    '''
-    database.cursor.execute(query)
-    database.connection.commit()
-
-
 def parse_regions(database: SqliteUtil, regions_file: str, src_epsg: int, 
         prj_epsg: int):
 
@@ -75,23 +69,25 @@ def parse_regions(database: SqliteUtil, regions_file: str, src_epsg: int,
     for item in iter_regions:
         points = (project(*point) for point in item.shape.points)
         polygon = Polygon(points)
+        centroid = polygon.centroid
         
         regions.append((
             item.record.MAZ_ID_10,
             item.record.TAZ_2015,
             item.record.Sq_miles,
-            dumps(polygon.centroid),
-            dumps(polygon)
+            centroid.x,
+            centroid.y,
+            polygon.wkb
         ))
 
     parser.close()
     
     log.info('Writing parsed regions to database.')
-    database.insert_values('regions', regions, 5)
+    database.insert_values('regions', regions, 6)
     database.connection.commit()
 
     log.info('Creating indexes on new tables.')
-    create_indexes(database)
+    create_indexes(database, 'regions')
 
 
 def main():
@@ -121,7 +117,7 @@ def main():
     home = path('')
 
     config = ConfigUtil.load_config(path('config.json'))
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'network')
 
     regions_file = config['network']['regions']['region_file']
 
@@ -146,7 +142,8 @@ def main():
 
     try:
         log.info('Starting regions parsing.')
-        parse_regions(database, regions_file, 2223, 2223)
+        with database.bulk_load():
+            parse_regions(database, regions_file, 2223, 2223)
     except:
         log.exception('Critical error while parsing regions; '
             'terminating process and exiting.')
@@ -1,14 +1,20 @@
 
 import os
 import logging as log
+import numpy as np
 
 from argparse import ArgumentParser
+from itertools import repeat
+from typing import Callable, List, Tuple
 from xml.etree.ElementTree import iterparse
+from pyproj import CRS
 from pyproj.transformer import Transformer
 
 from icarus.util.file import multiopen, exists
 from icarus.util.config import ConfigUtil
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.indexes import create_indexes
+from icarus.util.snapshot import write_snapshot
 
 
 def ready(networkpath: str):
@@ -33,7 +39,8 @@ def create_tables(database: SqliteUtil):
         CREATE TABLE nodes(
             node_id VARCHAR(255),
             maz SMALLINT UNSIGNED,
-            point VARCHAR(255)
+            x FLOAT,
+            y FLOAT
         );
     '''
     database.cursor.execute(query)
@@ -56,32 +63,25 @@ def create_tables(database: SqliteUtil):
     database.connection.commit()
 
 
-def create_indexes(database: SqliteUtil):
-    query = '''
-        CREATE INDEX nodes_node
-        ON nodes(node_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_link
-        ON links(link_id);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node1
-        ON links(source_node);
-    '''
-    database.cursor.execute(query)
-    query = '''
-        CREATE INDEX links_node2
-        ON links(terminal_node);
-    '''
-    database.cursor.execute(query)
+def write_nodes(database: SqliteUtil, nodes: List[Tuple[str,float,float]], 
+        project: Callable):
+    node_ids, xs, ys = zip(*nodes)
+    xs = np.array(xs, dtype=np.float64)
+    ys = np.array(ys, dtype=np.float64)
+    if project is not None:
+        xs, ys = project(xs, ys)
+    rows = zip(node_ids, repeat(None), xs.tolist(), ys.tolist())
+    database.insert_values('nodes', rows, 4)
+    database.connection.commit()
+
+
+def write_links(database: SqliteUtil, links: List[tuple]):
+    database.insert_values('links', links, 11)
     database.connection.commit()
 
 
 def parse_roads(database: SqliteUtil, networkpath: str,
-        src_epsg: int, prj_epsg: int):
+        src_epsg: int, prj_epsg: int, batch_size: int = 100000):
     log.info('Allocating tables for network links and nodes.')
     create_tables(database)
 
@@ -90,12 +90,18 @@ def parse_roads(database: SqliteUtil, networkpath: str,
     parser = iter(iterparse(network, events=('start', 'end')))
     evt, root = next(parser)
 
-    transformer = Transformer.from_crs(f'epsg:{src_epsg}', 
-        f'epsg:{prj_epsg}', always_xy=True, skip_equivalent=True)
-    project = transformer.transform
+    project = None
+    if CRS.from_epsg(src_epsg) != CRS.from_epsg(prj_epsg):
+        transformer = Transformer.from_crs(f'epsg:{src_epsg}', 
+            f'epsg:{prj_epsg}', always_xy=True, skip_equivalent=True)
+        project = transformer.transform
+    else:
+        log.info('Network is already in the target projection; '
+            'skipping node projection.')
 
     links = []
     nodes = []
+    container = root
     count, n = 0, 1
 
     for evt, elem in parser:
@@ -103,38 +109,38 @@ def parse_roads(database: SqliteUtil, networkpath: str,
             if elem.tag == 'nodes':
                 log.info('Parsing nodes from network file.')
                 count, n = 0, 1
+                container = elem
                 root.clear()
             elif elem.tag == 'links':
+                if len(nodes):
+                    write_nodes(database, nodes, project)
+                    nodes = []
                 if count != n << 1:
                     log.info(f'Parsing node {count}.')
                 log.info('Parsing links from network file.')
                 count, n = 0, 1
+                container = elem
                 root.clear()
         elif evt == 'end':
             if elem.tag == 'node':
-                node_id = str(elem.get('id'))
-                x = float(elem.get('x'))
-                y = float(elem.get('y'))
-                x, y = project(x, y)
-                wkt = f'POINT ({x} {y})'
                 nodes.append((
-                    node_id,
-                    None,
-                    wkt
+                    str(elem.get('id')),
+                    float(elem.get('x')),
+                    float(elem.get('y'))
                 ))
                 count += 1
                 if count == n:
                     log.info(f'Parsing node {count}.')
                     n <<= 1
-                if count % 100000 == 0:
-                    root.clear()
+                if count % batch_size == 0:
+                    write_nodes(database, nodes, project)
+                    nodes = []
+                    container.clear()
             elif elem.tag == 'link':
-                source_node = str(elem.get('from'))
-                terminal_node = str(elem.get('to'))
                 links.append((
                     str(elem.get('id')),
-                    source_node,
-                    terminal_node,
+                    str(elem.get('from')),
+                    str(elem.get('to')),
                     float(elem.get('length')),
                     float(elem.get('freespeed')),
                     float(elem.get('capacity')),
@@ -148,21 +154,27 @@ def parse_roads(database: SqliteUtil, networkpath: str,
                 if count == n:
                     log.info(f'Parsing link {count}.')
                     n <<= 1
-                if count % 100000 == 0:
-                    root.clear()
+                if count % batch_size == 0:
+                    write_links(database, links)
+                    links = []
+                    container.clear()
 
     if count != n << 1:
         log.info(f'Parsing link {count}.')
 
     network.close()
 
-    log.info('Writing parsed links and nodes to database.')
-    database.insert_values('nodes', nodes, 3)
-    database.insert_values('links', links, 11)
-    database.connection.commit()
+    log.info('Writing remaining links and nodes to database.')
+    if len(nodes):
+        write_nodes(database, nodes, project)
+    if len(links):
+        write_links(database, links)
 
     log.info('Creating indexes on new tables.')
-    create_indexes(database)
+    create_indexes(database, 'nodes', 'links')
+
+    log.info('Writing network snapshot.')
+    write_snapshot(database)
 
 
 def main():
@@ -194,7 +206,7 @@ def main():
     log.info('Running roads parsing tool.')
     log.info(f'Loading run data from {home}.')
 
-    database = SqliteUtil(path('database.db'))
+    database = open_database(home, 'network')
     networkpath = path('input/network.xml.gz')
 
     if not ready(networkpath):
@@ -210,7 +222,8 @@ def main():
     
     try:
         log.info('Starting roads parsing.')
-        parse_roads(database, networkpath, 2223, 2223)
+        with database.bulk_load():
+            parse_roads(database, networkpath, 2223, 2223)
     except:
         log.exception('Critical error while parsing roads; '
             'terminating process and exiting.')
@@ -0,0 +1,157 @@
+
+import numpy as np
+import shapely
+import logging as log
+
+from typing import Dict, Tuple
+
+from icarus.util.sqlite import SqliteUtil
+from icarus.util.geometry import load_polygons
+from icarus.util.indexes import create_indexes
+
+
+class MazDistances:
+    __slots__ = ('distances',)
+
+    def __init__(self, distances: Dict[Tuple[int,int],float]):
+        self.distances = distances
+
+
+    def __len__(self) -> int:
+        return len(self.distances)
+
+
+    def get(self, maz1: int, maz2: int) -> float:
+        if maz1 == maz2:
+            return 0.0
+        if maz2 < maz1:
+            maz1, maz2 = maz2, maz1
+        return self.distances.get((maz1, maz2))
+
+
+    def lookup(self, mazs1: np.ndarray, mazs2: np.ndarray) -> np.ndarray:
+        pairs = np.column_stack((np.minimum(mazs1, mazs2),
+            np.maximum(mazs1, mazs2)))
+        unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+        values = np.fromiter((np.nan if distance is None else distance
+                for distance in (self.distances.get(pair) 
+                    for pair in map(tuple, unique.tolist()))),
+            dtype=np.float64, count=len(unique))
+        distances = values[inverse.reshape(-1)]
+        distances[mazs1 == mazs2] = 0.0
+        return distances
+
+
+def create_distances_table(database: SqliteUtil):
+    database.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maz_distances(
+            origin_maz SMALLINT UNSIGNED,
+            dest_maz SMALLINT UNSIGNED,
+            distance FLOAT
+        );  ''')
+    database.connection.commit()
+
+
+def drop_distances_table(database: SqliteUtil):
+    schema = database.table_schema('maz_distances')
+    if schema is not None and database.writable(schema):
+        log.info('Dropping stale maz distance table.')
+        database.cursor.execute(f'DROP TABLE {schema}.maz_distances;')
+        database.connection.commit()
+
+
+def fetch_distances(database: SqliteUtil) -> Dict[Tuple[int,int],float]:
+    query = '''
+        SELECT
+            origin_maz,
+            dest_maz,
+            distance
+        FROM maz_distances; '''
+    distances = {}
+    for batch in database.fetch_batches(query):
+        distances.update(zip(
+            zip(batch.origin_maz.tolist(), batch.dest_maz.tolist()),
+            batch.distance.tolist()))
+
+    return distances
+
+
+def fetch_pairs(database: SqliteUtil) -> np.ndarray:
+    query = '''
+        SELECT DISTINCT
+            MIN(origMaz, destMaz) AS origin_maz,
+            MAX(origMaz, destMaz) AS dest_maz
+        FROM trips
+        WHERE origMaz != destMaz;   '''
+    batches = [np.column_stack((batch.origin_maz, batch.dest_maz))
+        for batch in database.fetch_batches(query)]
+    if not len(batches):
+        return np.zeros((0, 2), dtype=np.int64)
+
+    return np.concatenate(batches).astype(np.int64)
+
+
+def compute_distances(database: SqliteUtil, pairs: np.ndarray,
+        batch_size: int = 1000000) -> Tuple[np.ndarray,np.ndarray]:
+    query = '''
+        SELECT
+            maz,
+            region
+        FROM regions;   '''
+    mazs, polygons = load_polygons(database, query)
+    mazs = np.array(mazs, dtype=np.int64)
+    order = np.argsort(mazs)
+    mazs = mazs[order]
+    polygons = polygons[order]
+    shapely.prepare(polygons)
+
+    if not len(mazs):
+        return pairs[:0], np.zeros(0, dtype=np.float64)
+    idxs = np.searchsorted(mazs, pairs).clip(0, len(mazs) - 1)
+    known = np.all(mazs[idxs] == pairs, axis=1)
+    if not np.all(known):
+        log.warning(f'Skipping {np.sum(~known)} maz pairs missing regions.')
+    pairs = pairs[known]
+    idxs = idxs[known]
+
+    distances = np.empty(len(pairs), dtype=np.float64)
+    for low in range(0, len(pairs), batch_size):
+        high = min(low + batch_size, len(pairs))
+        log.info(f'Computing maz distances {low} to {high} of {len(pairs)}.')
+        distances[low:high] = shapely.distance(
+            polygons[idxs[low:high,0]], polygons[idxs[low:high,1]]) * 0.3048
+
+    return pairs, distances
+
+
+def load_distances(database: SqliteUtil, pairs: np.ndarray = None) \
+        -> MazDistances:
+    distances = {}
+    if database.table_exists('maz_distances'):
+        log.info('Loading cached maz distances.')
+        distances = fetch_distances(database)
+
+    if pairs is None:
+        log.info('Finding maz pairs used by trips.')
+        pairs = fetch_pairs(database)
+    if len(distances):
+        cached = np.fromiter(((origin, dest) in distances
+            for origin, dest in pairs.tolist()), dtype=bool, count=len(pairs))
+        pairs = pairs[~cached]
+    log.info(f'Found {len(distances)} cached and {len(pairs)} missing '
+        'maz pairs.')
+
+    if len(pairs):
+        pairs, values = compute_distances(database, pairs)
+        rows = list(zip(pairs[:,0].tolist(), pairs[:,1].tolist(),
+            values.tolist()))
+        distances.update(((origin, dest), distance)
+            for origin, dest, distance in rows)
+        if len(rows) and database.writable('main'):
+            log.info('Caching maz distances in database.')
+            create_distances_table(database)
+            database.insert_values('maz_distances', rows, 3)
+            database.connection.commit()
+            create_indexes(database, 'maz_distances')
+
+    return MazDistances(distances)
@@ -1,5 +1,6 @@
 
 import gzip
+import hashlib
 import os
 import sys
 import tempfile
@@ -14,6 +15,23 @@ def multiopen(filepath, mode='rt', **kwargs):
     return data
 
 
+def checksum(filepath, blocksize=1<<24):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as handle:
+        block = handle.read(blocksize)
+        while block:
+            digest.update(block)
+            block = handle.read(blocksize)
+    return digest.hexdigest()
+
+
+def fingerprint(filepath, previous=None):
+    stat = os.stat(filepath)
+    if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime):
+        return previous[:3]
+    return stat.st_size, stat.st_mtime, checksum(filepath)
+
+
 def touch(filepath):
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
     with open(filepath, 'w'):
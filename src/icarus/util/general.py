@@ -1,7 +1,9 @@
 
 import logging as log
 
-from typing import Callable, Hashable, Iterable, TypeVar
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Hashable, Iterable, Iterator, TypeVar
 from inspect import signature
 
 
@@ -30,6 +32,29 @@ def counter(iterable: Iterable, message: str, start: int = 1,
         log.log(level, message % count)
 
 
+def pmap(function: Callable, iterable: Iterable, workers: int = 1, 
+        initializer: Callable = None, initargs: tuple = (), 
+        lookahead: int = None) -> Iterator[Any]:
+    if workers is None or workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in iterable:
+            yield function(item)
+        return
+
+    if lookahead is None:
+        lookahead = 2 * workers
+    with ProcessPoolExecutor(workers, initializer=initializer, 
+            initargs=initargs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= lookahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 T = TypeVar('T')
 
 class defaultdict(dict):
@@ -0,0 +1,49 @@
+
+import numpy as np
+import shapely
+
+from typing import Dict, List, Tuple
+
+from icarus.util.sqlite import SqliteUtil
+
+
+def load_points(database: SqliteUtil, query: str, params: tuple = ()) \
+        -> Tuple[List, np.ndarray]:
+    database.cursor.execute(query, params)
+    rows = database.cursor.fetchall()
+    if not len(rows):
+        return [], np.zeros((0, 2), dtype=np.float64)
+    keys, x, y = zip(*rows)
+    coords = np.array((x, y), dtype=np.float64).T
+
+    return list(keys), coords
+
+
+def load_polygons(database: SqliteUtil, query: str, params: tuple = ()) \
+        -> Tuple[List, np.ndarray]:
+    database.cursor.execute(query, params)
+    rows = database.cursor.fetchall()
+    if not len(rows):
+        return [], np.zeros(0, dtype=object)
+    keys, blobs = zip(*rows)
+    polygons = shapely.from_wkb(np.array(blobs, dtype=object))
+
+    return list(keys), polygons
+
+
+def load_nodes(database: SqliteUtil) -> Tuple[Dict[str, int], np.ndarray]:
+    query = '''
+        SELECT
+            node_id,
+            x,
+            y
+        FROM nodes;
+    '''
+    keys, coords = load_points(database, query)
+    nodes = {node_id: idx for idx, node_id in enumerate(keys)}
+
+    return nodes, coords
+
+
+def dump_polygons(polygons: np.ndarray) -> List[bytes]:
+    return shapely.to_wkb(polygons).tolist()
@@ -0,0 +1,14 @@
+
+import numpy as np
+
+
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def splitmix64(values: np.ndarray, salt: int = GOLDEN) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64) + np.uint64(salt)
+    values = (values ^ (values >> np.uint64(30))) * MIX1
+    values = (values ^ (values >> np.uint64(27))) * MIX2
+    return values ^ (values >> np.uint64(31))
@@ -0,0 +1,120 @@
+
+import logging as log
+
+from typing import Dict, Tuple
+
+from icarus.util.sqlite import SqliteUtil
+
+
+indexes: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    'regions': (
+        ('regions_maz', 'maz'),
+    ),
+    'nodes': (
+        ('nodes_node', 'node_id'),
+    ),
+    'links': (
+        ('links_link', 'link_id'),
+        ('links_node1', 'source_node'),
+        ('links_node2', 'terminal_node'),
+        ('links_air', 'air_temperature'),
+        ('links_mrt', 'mrt_temperature')
+    ),
+    'maz_distances': (
+        ('maz_distances_pair', 'origin_maz, dest_maz'),
+    ),
+    'parcels': (
+        ('parcels_apn', 'apn'),
+        ('parcels_maz', 'maz'),
+        ('parcels_air', 'air_temperature'),
+        ('parcels_mrt', 'mrt_temperature')
+    ),
+    'air_temperatures': (
+        ('air_temperatures_temperature', 'temperature_id, temperature_idx'),
+    ),
+    'mrt_temperatures': (
+        ('mrt_temperatures_temperature', 'temperature_id, temperature_idx'),
+    ),
+    'mrt_profiles': (
+        ('mrt_profiles_temperature', 'temperature_id'),
+    ),
+    'trips': (
+        ('trips_trip', 'hhid, pnum, personTripNum'),
+    ),
+    'households': (
+        ('household_households', 'hhid'),
+    ),
+    'persons': (
+        ('persons_person', 'hhid, pnum'),
+    ),
+    'agents': (
+        ('agents_agent', 'agent_id'),
+        ('agents_household', 'household_id, household_idx')
+    ),
+    'activities': (
+        ('activities_activity', 'activity_id'),
+        ('activities_agent', 'agent_id, agent_idx'),
+        ('activities_parcel', 'apn')
+    ),
+    'legs': (
+        ('legs_leg', 'leg_id'),
+        ('legs_agent', 'agent_id, agent_idx')
+    ),
+    'output_agents': (
+        ('output_agents_agent', 'agent_id'),
+    ),
+    'output_activities': (
+        ('output_activities_agent', 'agent_id, agent_idx'),
+        ('output_activities_activity', 'activity_id')
+    ),
+    'output_legs': (
+        ('output_legs_agent', 'agent_id, agent_idx'),
+        ('output_legs_leg', 'leg_id')
+    ),
+    'output_events': (
+        ('output_events_event', 'event_id'),
+        ('output_events_link', 'link_id'),
+        ('output_events_leg', 'leg_id, leg_idx')
+    )
+}
+
+
+def drop_indexes(database: SqliteUtil, *tables: str):
+    for table in tables:
+        schema = database.table_schema(table)
+        if schema is None or not database.writable(schema):
+            continue
+        query = f'''
+            SELECT name
+            FROM {schema}.sqlite_master
+            WHERE type = 'index'
+            AND tbl_name = ?
+            AND sql IS NOT NULL;
+        '''
+        database.cursor.execute(query, (table,))
+        names = [row[0] for row in database.cursor.fetchall()]
+        for name in names:
+            database.cursor.execute(f'DROP INDEX IF EXISTS {schema}.{name};')
+        if len(names):
+            log.debug(f'Dropped {len(names)} indexes on table {table}.')
+    database.connection.commit()
+
+
+def create_indexes(database: SqliteUtil, *tables: str, analyze: bool = True):
+    for table in tables:
+        schema = database.table_schema(table)
+        if schema is None:
+            log.warning(f'Cannot index missing table {table}.')
+            continue
+        if not database.writable(schema):
+            log.debug(f'Skipping indexes on read only table {table}.')
+            continue
+        for name, columns in indexes.get(table, ()):
+            query = f'''
+                CREATE INDEX IF NOT EXISTS {schema}.{name}
+                ON {table}({columns});
+            '''
+            database.cursor.execute(query)
+        if analyze:
+            database.cursor.execute(f'ANALYZE {schema}.{table};')
+    database.connection.commit()
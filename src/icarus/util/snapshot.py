@@ -0,0 +1,235 @@
+
+import os
+import json
+import hashlib
+import numpy as np
+import logging as log
+
+from typing import Dict, Iterable, Tuple
+
+from icarus.util.sqlite import SqliteUtil
+
+
+arrays = (
+    'node_ids', 'node_sorted', 'node_order', 'node_maz', 'node_x', 'node_y',
+    'link_ids', 'link_sorted', 'link_order', 'link_source', 'link_terminal',
+    'link_length', 'link_freespeed', 'link_modes', 'link_air', 'link_mrt'
+)
+
+
+def snapshot_path(database: SqliteUtil) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(database.name)),
+        'network')
+
+
+def sort_ids(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(ids, kind='stable')
+    return ids[order], order
+
+
+def encode_modes(modes: Iterable[str]) -> Tuple[np.ndarray, list]:
+    vocabulary: Dict[str,int] = {}
+    masks = []
+    for link_modes in modes:
+        mask = 0
+        for mode in link_modes.split(','):
+            if mode not in vocabulary:
+                vocabulary[mode] = len(vocabulary)
+            mask |= 1 << vocabulary[mode]
+        masks.append(mask)
+    if len(vocabulary) > 32:
+        raise ValueError('Network has more than 32 distinct link modes.')
+
+    return np.array(masks, dtype=np.uint32), list(vocabulary.keys())
+
+
+node_query = '''
+    SELECT
+        node_id,
+        maz,
+        x,
+        y
+    FROM nodes
+    ORDER BY rowid;
+'''
+
+link_query = '''
+    SELECT
+        link_id,
+        source_node,
+        terminal_node,
+        length,
+        freespeed,
+        modes,
+        air_temperature,
+        mrt_temperature
+    FROM links
+    ORDER BY rowid;
+'''
+
+
+def fetch_digest(database: SqliteUtil, query: str, batch_size: int = 100000,
+        keep: bool = False) -> Tuple[list,int,str]:
+    digest = hashlib.sha1()
+    rows = []
+    count = 0
+    cursor = database.connection.cursor()
+    cursor.execute(query)
+    batch = cursor.fetchmany(batch_size)
+    while len(batch):
+        digest.update(repr(batch).encode())
+        count += len(batch)
+        if keep:
+            rows.extend(batch)
+        batch = cursor.fetchmany(batch_size)
+    cursor.close()
+
+    return rows, count, digest.hexdigest()
+
+
+def digest_network(database: SqliteUtil) -> Dict[str,str]:
+    return {table: fetch_digest(database, query)[2] for table, query in
+        (('nodes', node_query), ('links', link_query))}
+
+
+def write_snapshot(database: SqliteUtil, path: str = None):
+    if path is None:
+        path = snapshot_path(database)
+    os.makedirs(path, exist_ok=True)
+    digests = {}
+
+    log.info('Loading network nodes for snapshot.')
+    rows, _, digests['nodes'] = fetch_digest(database, node_query, keep=True)
+    if len(rows):
+        node_ids, mazs, xs, ys = zip(*rows)
+    else:
+        node_ids = mazs = xs = ys = ()
+    nodes = {node_id: idx for idx, node_id in enumerate(node_ids)}
+
+    log.info('Loading network links for snapshot.')
+    rows, _, digests['links'] = fetch_digest(database, link_query, keep=True)
+    if len(rows):
+        link_ids, sources, terminals, lengths, speeds, modes, air, mrt = \
+            zip(*rows)
+    else:
+        link_ids = sources = terminals = lengths = speeds = modes = air = \
+            mrt = ()
+    nullable = lambda uuid: -1 if uuid is None else uuid
+
+    data = {}
+    data['node_ids'] = np.array(node_ids, dtype=str)
+    data['node_sorted'], data['node_order'] = sort_ids(data['node_ids'])
+    data['node_maz'] = np.array([nullable(maz) for maz in mazs], 
+        dtype=np.int64)
+    data['node_x'] = np.array(xs, dtype=np.float64)
+    data['node_y'] = np.array(ys, dtype=np.float64)
+    data['link_ids'] = np.array(link_ids, dtype=str)
+    data['link_sorted'], data['link_order'] = sort_ids(data['link_ids'])
+    data['link_source'] = np.array([nodes[node] for node in sources],
+        dtype=np.int64)
+    data['link_terminal'] = np.array([nodes[node] for node in terminals],
+        dtype=np.int64)
+    data['link_length'] = np.array(lengths, dtype=np.float64)
+    data['link_freespeed'] = np.array(speeds, dtype=np.float64)
+    data['link_modes'], vocabulary = encode_modes(modes)
+    data['link_air'] = np.array([nullable(uuid) for uuid in air],
+        dtype=np.int64)
+    data['link_mrt'] = np.array([nullable(uuid) for uuid in mrt],
+        dtype=np.int64)
+
+    log.info(f'Writing network snapshot to {path}.')
+    metapath = os.path.join(path, 'meta.json')
+    if os.path.exists(metapath):
+        os.remove(metapath)
+    for name in arrays:
+        filepath = os.path.join(path, f'{name}.npy')
+        with open(filepath + '.tmp', 'wb') as npyfile:
+            np.save(npyfile, data[name])
+        os.replace(filepath + '.tmp', filepath)
+    meta = {
+        'nodes': len(data['node_ids']),
+        'links': len(data['link_ids']),
+        'modes': vocabulary,
+        'digests': digests
+    }
+    with open(metapath, 'w') as metafile:
+        json.dump(meta, metafile)
+
+
+def fingerprint_network(database: SqliteUtil, column: str,
+        batch_size: int = 100000) -> Dict[str,tuple]:
+    entries = {}
+    for table, key in (('links', 'link_id'), ('parcels', 'apn')):
+        query = f'SELECT {key}, {column} FROM {table} ORDER BY rowid;'
+        _, count, digest = fetch_digest(database, query, batch_size)
+        entries[table] = ('network', count, None, digest, None)
+
+    return entries
+
+
+def load_snapshot(database: SqliteUtil, path: str = None) -> 'NetworkSnapshot':
+    if path is None:
+        path = snapshot_path(database)
+    if not NetworkSnapshot.exists(path):
+        log.info('Network snapshot not found; building it from database.')
+        write_snapshot(database, path)
+    snapshot = NetworkSnapshot(path)
+    if snapshot.digests != digest_network(database):
+        log.info('Network snapshot is out of date; rebuilding it.')
+        write_snapshot(database, path)
+        snapshot = NetworkSnapshot(path)
+
+    return snapshot
+
+
+class NetworkSnapshot:
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as metafile:
+            meta = json.load(metafile)
+        self.nodes = meta['nodes']
+        self.links = meta['links']
+        self.modes = meta['modes']
+        self.digests = meta.get('digests')
+        for name in arrays:
+            filepath = os.path.join(path, f'{name}.npy')
+            setattr(self, name, np.load(filepath, mmap_mode='r'))
+        self.mode_sets: Dict[int,Tuple[str]] = {}
+
+
+    def node_coords(self) -> np.ndarray:
+        return np.stack((self.node_x, self.node_y), axis=1)
+
+
+    def lookup(self, ids: Iterable[str], sorted_ids: np.ndarray,
+            order: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype=str)
+        pos = np.searchsorted(sorted_ids, ids)
+        pos[pos == len(sorted_ids)] = 0
+        found = np.zeros(len(ids), dtype=bool)
+        if len(sorted_ids):
+            found = sorted_ids[pos] == ids
+        if not np.all(found):
+            missing = ', '.join(ids[~found][:5].tolist())
+            raise KeyError(f'Ids not found in network snapshot: {missing}.')
+        return np.asarray(order[pos])
+
+
+    def node_index(self, node_ids: Iterable[str]) -> np.ndarray:
+        return self.lookup(node_ids, self.node_sorted, self.node_order)
+
+
+    def link_index(self, link_ids: Iterable[str]) -> np.ndarray:
+        return self.lookup(link_ids, self.link_sorted, self.link_order)
+
+
+    def decode_modes(self, mask: int) -> Tuple[str]:
+        if mask not in self.mode_sets:
+            self.mode_sets[mask] = tuple(mode for bit, mode in
+                enumerate(self.modes) if mask & (1 << bit))
+        return self.mode_sets[mask]
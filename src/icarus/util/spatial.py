@@ -0,0 +1,121 @@
+
+import os
+import json
+import hashlib
+import numpy as np
+import shapely
+import logging as log
+
+from typing import Tuple
+from rtree.index import Index, Property
+
+from icarus.util.sqlite import SqliteUtil
+
+
+def index_path(database: SqliteUtil, name: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(database.name)),
+        'spatial', name)
+
+
+def point_bounds(points: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(np.hstack((points, points)), dtype=np.float64)
+
+
+def bounds_key(bounds: np.ndarray) -> str:
+    bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+    return hashlib.sha1(bounds.tobytes()).hexdigest()
+
+
+def remove_index(basepath: str):
+    for ext in ('.idx', '.dat', '.json'):
+        if os.path.exists(basepath + ext):
+            os.remove(basepath + ext)
+
+
+def stream_bounds(bounds: np.ndarray):
+    for idx, box in enumerate(bounds.tolist()):
+        yield (idx, box, None)
+
+
+def memory_index(bounds: np.ndarray) -> Index:
+    return Index(stream_bounds(bounds)) if len(bounds) else Index()
+
+
+def load_index(basepath: str, bounds: np.ndarray) -> Index:
+    key = bounds_key(bounds)
+    metapath = basepath + '.json'
+    if os.path.exists(metapath):
+        with open(metapath, 'r') as metafile:
+            meta = json.load(metafile)
+        if meta['key'] == key and meta['size'] == len(bounds):
+            log.info(f'Reopening spatial index {basepath}.')
+            return open_index(basepath)
+
+    log.info(f'Building spatial index {basepath}.')
+    os.makedirs(os.path.dirname(basepath), exist_ok=True)
+    remove_index(basepath)
+
+    properties = Property()
+    properties.overwrite = True
+    index = Index(basepath, stream_bounds(bounds), properties=properties) \
+        if len(bounds) else Index(basepath, properties=properties)
+    index.flush()
+    with open(metapath, 'w') as metafile:
+        json.dump({'key': key, 'size': len(bounds)}, metafile)
+
+    return index
+
+
+def open_index(basepath: str) -> Index:
+    properties = Property()
+    properties.overwrite = False
+    return Index(basepath, properties=properties)
+
+
+def intersection(index: Index, bounds: np.ndarray) \
+        -> Tuple[np.ndarray,np.ndarray]:
+    bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+    ids, counts = index.intersection_v(
+        np.ascontiguousarray(bounds[:,:2]), np.ascontiguousarray(bounds[:,2:]))
+    queries = np.repeat(np.arange(len(bounds)), counts.astype(np.int64))
+
+    return queries, ids.astype(np.int64)
+
+
+def nearest(index: Index, bounds: np.ndarray, num: int = 1,
+        max_dists: np.ndarray = None) -> Tuple[np.ndarray,np.ndarray]:
+    bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+    ids, counts = index.nearest_v(
+        np.ascontiguousarray(bounds[:,:2]), np.ascontiguousarray(bounds[:,2:]),
+        num_results=num, max_dists=max_dists, strict=True)
+    queries = np.repeat(np.arange(len(bounds)), counts.astype(np.int64))
+
+    return queries, ids.astype(np.int64)
+
+
+def nearest_one(index: Index, points: np.ndarray) -> np.ndarray:
+    queries, ids = nearest(index, point_bounds(points))
+    first = np.ones(len(queries), dtype=bool)
+    first[1:] = queries[1:] != queries[:-1]
+    result = np.full(len(points), -1, dtype=np.int64)
+    result[queries[first]] = ids[first]
+
+    return result
+
+
+def contains(index: Index, polygons: np.ndarray, points: np.ndarray) \
+        -> Tuple[np.ndarray,np.ndarray]:
+    queries, ids = intersection(index, shapely.bounds(polygons))
+    inside = shapely.contains_xy(polygons[queries],
+        points[ids,0], points[ids,1])
+
+    return queries[inside], ids[inside]
+
+
+def within(index: Index, points: np.ndarray, polygons: np.ndarray) \
+        -> Tuple[np.ndarray,np.ndarray]:
+    queries, ids = intersection(index, point_bounds(points))
+    inside = shapely.contains_xy(polygons[ids],
+        points[queries,0], points[queries,1])
+
+    return queries[inside], ids[inside]
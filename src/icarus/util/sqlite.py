@@ -2,30 +2,133 @@
 import sqlite3
 import re
 import os
+import numpy as np
+import logging as log
+
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from queue import LifoQueue, Empty
+from threading import Lock
+from urllib.parse import quote
 
 from icarus.util.iter import chunk
+from icarus.util.config import ConfigUtil
+
+
+stage_files = {
+    'abm': 'abm.db',
+    'network': 'network.db',
+    'temperature': 'temperature.db',
+    'population': 'population.db',
+    'output': 'output.db',
+    'exposure': 'exposure.db'
+}
+
+# stages that also write columns into tables owned by other stages
+stage_writes = {
+    'temperature': ('network',)
+}
+
+
+def open_database(folder, stage, readonly=False, timeout=30):
+    folder = os.path.abspath(folder)
+    configpath = os.path.join(folder, 'config.json')
+    layout = {}
+    if os.path.exists(configpath):
+        layout = ConfigUtil.load_config(configpath).get('database') or {}
+    wal = layout.get('wal', False)
+    if not layout.get('split', False):
+        return SqliteUtil(os.path.join(folder, 'database.db'), readonly, 
+            timeout, wal=wal)
+
+    files = {**stage_files, **layout.get('files', {})}
+    files = {name: os.path.join(folder, path) for name, path in files.items()}
+    shared = set(layout.get('readonly', ()))
+    if stage not in files:
+        log.error(f'Database layout has no file for stage "{stage}".')
+        raise ValueError
+    if stage in shared and not readonly:
+        log.error(f'Stage "{stage}" cannot write to its database file '
+            f'{files[stage]} because it is marked read only.')
+        raise ValueError
+    if not readonly:
+        for other in stage_writes.get(stage, ()):
+            if other in shared:
+                log.error(f'Stage "{stage}" writes to the {other} database '
+                    f'{files[other]}, which is marked read only.')
+                raise ValueError
+
+    attach = {name: (path, name in shared) for name, path in files.items()
+        if name != stage and os.path.exists(path)}
+    log.info(f'Opening {stage} database {files[stage]} with '
+        f'{len(attach)} attached stage databases.')
+
+    return SqliteUtil(files[stage], readonly, timeout, attach, wal)
 
 
 class SqliteUtil:
-    def __init__(self, database, readonly=False, timeout=30):
+    bulk_pragmas = {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'cache_size': -1048576,
+        'temp_store': 'MEMORY',
+        'mmap_size': 1 << 30,
+        'locking_mode': 'EXCLUSIVE'
+    }
+    read_pragmas = {
+        'cache_size': -262144,
+        'temp_store': 'MEMORY',
+        'mmap_size': 1 << 30
+    }
+
+    def __init__(self, database, readonly=False, timeout=30, attach=None, 
+            wal=False):
         self.name = database
         self.timeout = timeout
         self.readonly = readonly
+        self.attached = {} if attach is None else dict(attach)
+        self.wal = wal
         self.connection = None
         self.cursor = None
+        self.batch_size = None
         self.open(timeout)
 
 
+    @staticmethod
+    def file_uri(path, readonly=False):
+        uri = f'file:{quote(os.path.abspath(path))}'
+        return uri + '?mode=ro' if readonly else uri
+
+
     def open(self, timeout):
         if self.connection is not None:
             self.close()
-        if self.readonly:
-            path = os.path.abspath(self.name)
-            uri = f'file:{path}?mode=ro'
-            self.connection = sqlite3.connect(uri, uri=True, timeout=timeout)
+        if self.readonly or len(self.attached):
+            uri = self.file_uri(self.name, self.readonly)
+            self.connection = sqlite3.connect(uri, uri=True, timeout=timeout,
+                check_same_thread=not self.readonly)
         else: 
             self.connection = sqlite3.connect(self.name, timeout=timeout)
         self.cursor = self.connection.cursor()
+        for schema, (path, readonly) in self.attached.items():
+            log.debug(f'Attaching database {path} as {schema}.')
+            uri = self.file_uri(path, readonly or self.readonly)
+            self.cursor.execute(f'ATTACH DATABASE ? AS {schema};', (uri,))
+        if self.wal and not self.readonly:
+            for schema in self.schemas():
+                if self.writable(schema):
+                    self.set_pragma('journal_mode', 'WAL', schema)
+                    self.set_pragma('synchronous', 'NORMAL', schema)
+
+
+    def reader(self, **pragmas):
+        return self.pool(1, **pragmas).open_reader()
+
+
+    def pool(self, size=4, **pragmas):
+        return SqlitePool(self.name, size, self.timeout, self.attached, 
+            **pragmas)
 
 
     def close(self):
@@ -39,23 +142,6 @@ class SqliteUtil:
         return self.cursor.fetchall()[0][0]
 
 
-    # def fetch_rows(self, chunk=None, block=1000000):
-
-    #     def chunks(lst, n):
-    #         for i in range(0, len(lst), n):
-    #             yield lst[i:i + n]
-
-    #     rows = self.cursor.fetchmany(block)
-    #     while len(rows):
-    #         if chunk is None:
-    #             for row in rows:
-    #                 yield row
-    #         else:
-    #             for row in chunks(rows, chunk):
-    #                 yield row
-    #         rows = self.cursor.fetchmany(block)
-
-
     def fetch_rows(self, chunk_size=None, block_size=1000000):
         rows = self.cursor.fetchmany(block_size)
         while len(rows):
@@ -63,15 +149,60 @@ class SqliteUtil:
                 for row in rows:
                     yield row
             else:
-                for row in chunk(row, chunk_size):
-                    yield row    
+                for group in chunk(rows, chunk_size):
+                    yield group
             rows = self.cursor.fetchmany(block_size)
 
-    
-    def fetch_tables(self):
-        self.cursor.execute('SELECT name FROM sqlite_master WHERE type="table";')
-        tables = self.cursor.fetchall()
-        return [table[0] for table in tables]
+
+    def fetch_batches(self, query, batch_size=1000000, dtypes=None, params=()):
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        names = [column[0] for column in cursor.description]
+        if dtypes is None:
+            dtypes = [None] * len(names)
+        elif isinstance(dtypes, dict):
+            dtypes = [dtypes.get(name) for name in names]
+        if len(dtypes) != len(names):
+            raise ValueError(f'Expected {len(names)} column dtypes but '
+                f'received {len(dtypes)}.')
+
+        try:
+            rows = cursor.fetchmany(batch_size)
+            while len(rows):
+                columns = zip(*rows)
+                arrays = [np.array(column, dtype=dtype) 
+                    for column, dtype in zip(columns, dtypes)]
+                yield np.rec.fromarrays(arrays, names=names)
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+
+
+    def schemas(self):
+        return ('main', *self.attached.keys())
+
+
+    def writable(self, schema):
+        if self.readonly:
+            return False
+        return schema == 'main' or not self.attached[schema][1]
+
+
+    def fetch_tables(self, schema=None):
+        tables = []
+        schemas = self.schemas() if schema is None else (schema,)
+        for schema in schemas:
+            self.cursor.execute(f'SELECT name FROM {schema}.sqlite_master '
+                'WHERE type="table";')
+            tables.extend(table[0] for table in self.cursor.fetchall())
+        return tables
+
+
+    def table_schema(self, table):
+        for schema in self.schemas():
+            if table in self.fetch_tables(schema):
+                return schema
+        return None
 
     
     def drop_temporaries(self):
@@ -93,7 +224,99 @@ class SqliteUtil:
     def insert_values(self, table, values, cols):
         columns = ', '.join('?' * cols)
         query = f'INSERT INTO {table} VALUES({columns});'
-        self.cursor.executemany(query, values)
+        if self.batch_size is None:
+            self.cursor.executemany(query, values)
+        else:
+            values = iter(values)
+            batch = list(islice(values, self.batch_size))
+            while len(batch):
+                self.cursor.executemany(query, batch)
+                self.connection.commit()
+                batch = list(islice(values, self.batch_size))
+
+
+    def patch_column(self, table, key, column, source, batch_size=100000):
+        self.cursor.execute(f'CREATE INDEX IF NOT EXISTS {source}_{key} '
+            f'ON {source}({key});')
+        total = self.count_rows(table)
+        query = f'''
+            SELECT COUNT(*)
+            FROM {table}
+            INNER JOIN {source}
+            ON {table}.{key} = {source}.{key};
+        '''
+        self.cursor.execute(query)
+        matched = self.cursor.fetchall()[0][0]
+        if matched != total:
+            log.error(f'Patch table {source} matches {matched} of {total} '
+                f'{table} rows; quiting to prevent data loss.')
+            raise RuntimeError
+
+        self.cursor.execute(f'SELECT MIN(rowid), MAX(rowid) FROM {table};')
+        low, high = self.cursor.fetchall()[0]
+        query = f'''
+            UPDATE {table}
+            SET {column} = {source}.{column}
+            FROM {source}
+            WHERE {table}.{key} = {source}.{key}
+            AND {table}.rowid BETWEEN ? AND ?;
+        '''
+        patched = 0
+        start = low
+        while low is not None and start <= high:
+            self.cursor.execute(query, (start, start + batch_size - 1))
+            patched += self.cursor.rowcount
+            self.connection.commit()
+            log.info(f'Patched {column} on {patched} of {total} {table} rows.')
+            start += batch_size
+
+        if patched != total:
+            log.error(f'Patched {patched} {table} rows but expected {total}.')
+            raise RuntimeError
+
+        return patched
+
+
+    def get_pragma(self, pragma, schema='main'):
+        self.cursor.execute(f'PRAGMA {schema}.{pragma};')
+        return self.cursor.fetchall()[0][0]
+
+
+    def set_pragma(self, pragma, value, schema='main'):
+        self.cursor.execute(f'PRAGMA {schema}.{pragma} = {value};')
+        self.cursor.fetchall()
+
+
+    @contextmanager
+    def bulk_load(self, batch_size=1000000, **pragmas):
+        settings = dict(self.bulk_pragmas)
+        if self.wal:
+            # keep the write ahead log so readers are not locked out
+            del settings['journal_mode'], settings['locking_mode']
+        settings.update(pragmas)
+        self.connection.commit()
+        previous = {(schema, pragma): self.get_pragma(pragma, schema) 
+            for schema in self.schemas() for pragma in settings}
+        log.debug(f'Entering bulk load mode with pragmas {settings}.')
+        for schema in self.schemas():
+            for pragma, value in settings.items():
+                self.set_pragma(pragma, value, schema)
+        self.batch_size = batch_size
+
+        try:
+            yield self
+            self.connection.commit()
+        finally:
+            self.batch_size = None
+            if self.connection.in_transaction:
+                self.connection.rollback()
+            log.debug(f'Restoring pragmas {previous}.')
+            for (schema, pragma), value in previous.items():
+                self.set_pragma(pragma, value, schema)
+            # the exclusive lock is only released on the next access
+            for schema in self.schemas():
+                self.cursor.execute(f'SELECT COUNT(*) FROM {schema}.sqlite_master;')
+                self.cursor.fetchall()
 
     
     def write_metadata(self, fields = {}, **kwargs):
@@ -110,9 +333,9 @@ class SqliteUtil:
             '''
             self.cursor.execute(query)
         else:
-            remove = (f'field = {field}' for field in fields)
-            condition = ', OR '.join(remove)
-            query = f'DELETE FROM metadata WHERE {condition};'
+            condition = ', '.join('?' * len(fields))
+            query = f'DELETE FROM metadata WHERE field IN ({condition});'
+            self.cursor.execute(query, tuple(fields.keys()))
         
         values = ((key, val, type(val).__name__) for key, val in fields.items())
         self.insert_values('metadata', values, 3)
@@ -130,6 +353,7 @@ class SqliteUtil:
         self.drop_table('metadata')
         query = 'ALTER TABLE temp_metadata RENAME TO metadata'
         self.cursor.execute(query)
+        self.connection.commit()
 
     
     def fetch_metadata(self):
@@ -152,17 +376,138 @@ class SqliteUtil:
         return metadata
 
 
+    def fetch_manifest(self, stage):
+        manifest = {}
+        if len(self.table_exists('manifest')):
+            query = '''
+                SELECT
+                    path,
+                    kind,
+                    size,
+                    mtime,
+                    hash,
+                    key
+                FROM manifest
+                WHERE stage = ?;
+            '''
+            self.cursor.execute(query, (stage,))
+            for path, kind, size, mtime, digest, key in self.fetch_rows():
+                manifest[path] = (kind, size, mtime, digest, key)
+        
+        return manifest
+
+
+    def write_manifest(self, stage, entries):
+        query = '''
+            CREATE TABLE IF NOT EXISTS manifest(
+                stage VARCHAR(255),
+                path TEXT,
+                kind VARCHAR(255),
+                size INT UNSIGNED,
+                mtime FLOAT,
+                hash VARCHAR(255),
+                key INT
+            );
+        '''
+        self.cursor.execute(query)
+        self.cursor.execute('DELETE FROM manifest WHERE stage = ?;', (stage,))
+        values = ((stage, path, *entry) for path, entry in entries.items())
+        self.insert_values('manifest', values, 7)
+        self.connection.commit()
+
+
     def get_schema(self, table):
+        schema = self.table_schema(table)
         query = f'''
             SELECT sql 
-            FROM sqlite_master 
-            WHERE type="tabl"' 
-            AND name="{table}";
+            FROM {schema}.sqlite_master 
+            WHERE type="table"
+            AND name=?;
         '''
-        self.cursor.execute(query)
+        self.cursor.execute(query, (table,))
         return self.cursor.fetchall()[0][0]
 
     
     def copy_schema(self, old_table, new_table):
         query = self.get_schema(old_table)
         self.cursor.execute(query)
+
+
+class SqlitePool:
+    def __init__(self, database, size=4, timeout=30, attach=None, **pragmas):
+        self.name = database
+        self.size = size
+        self.timeout = timeout
+        self.attached = {} if attach is None else dict(attach)
+        self.pragmas = pragmas
+        self.idle = LifoQueue()
+        self.opened = 0
+        self.lock = Lock()
+
+
+    def __getstate__(self):
+        return (self.name, self.size, self.timeout, self.attached, 
+            self.pragmas)
+
+
+    def __setstate__(self, state):
+        name, size, timeout, attach, pragmas = state
+        self.__init__(name, size, timeout, attach, **pragmas)
+
+
+    def open_reader(self):
+        reader = SqliteUtil(self.name, True, self.timeout, self.attached)
+        settings = {**SqliteUtil.read_pragmas, **self.pragmas}
+        for schema in reader.schemas():
+            for pragma, value in settings.items():
+                reader.set_pragma(pragma, value, schema)
+        return reader
+
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            create = self.opened < self.size
+            if create:
+                self.opened += 1
+        if create:
+            try:
+                return self.open_reader()
+            except:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        return self.idle.get()
+
+
+    def release(self, reader):
+        self.idle.put(reader)
+
+
+    @contextmanager
+    def connection(self):
+        reader = self.acquire()
+        try:
+            yield reader
+        finally:
+            self.release(reader)
+
+
+    def map(self, function, items):
+        def run(item):
+            with self.connection() as reader:
+                return function(reader, item)
+        with ThreadPoolExecutor(self.size) as executor:
+            return list(executor.map(run, items))
+
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+        self.opened = 0
@@ -5,7 +5,7 @@ from argparse import ArgumentParser
 
 from icarus.validate.trips.trips import Trips
 from icarus.util.config import ConfigUtil
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import open_database
 
 parser = ArgumentParser()
 parser.add_argument('--folder', type=str, dest='folder', default='.')
@@ -23,6 +23,6 @@ log.basicConfig(
     level=getattr(log, args.level.upper()),
     handlers=handlers)
 
-database = SqliteUtil('database.db')
+database = open_database(args.folder, 'population')
 trips = Trips(database)
 trips.minimum_distance()
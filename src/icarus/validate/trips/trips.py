@@ -1,21 +1,9 @@
 
 import logging as log
-from pyproj import Transformer
-from shapely.wkt import loads
-from shapely.geometry import Polygon
 
 from icarus.generate.population.types import Mode
 from icarus.util.sqlite import SqliteUtil
-from icarus.util.general import defaultdict
-
-
-def region_coords(region):
-    result = []
-    points = region[10:-2].split(', ')
-    for point in points:
-        x, y = point.split(' ')
-        result.append((float(x), float(y)))
-    return result
+from icarus.util.distances import load_distances
 
 
 class Trips:
@@ -23,38 +11,6 @@ class Trips:
         self.database = database
 
 
-    def get_regions(self):
-        query = '''
-            SELECT
-                maz,
-                region
-            FROM regions;   '''
-        self.database.cursor.execute(query)
-        return self.database.cursor.fetchall()
-
-    
-    def load_regions(self):
-        regions = {}
-
-        n = 1
-        count = 0
-        for maz, polygon in self.get_regions():
-            coords = region_coords(polygon)
-            shape = Polygon(coords)
-            setattr(shape, 'maz', maz)
-            regions[maz] = shape
-
-            count += 1
-            if count == n:
-                log.info(f'Loading region {count}.')
-                n <<= 1
-
-        if count != n >> 1:
-            log.info(f'Loading region {count}.')
-        
-        return regions
-
-
     def get_trips(self, bin_size=100000):
         query = '''
             SELECT
@@ -74,9 +30,8 @@ class Trips:
     def minimum_distance(self):
         log.info('Running lower bound speed test.')
         
-        log.info('Loading regions.')
-        regions = self.load_regions()
-        distances = {}
+        log.info('Loading maz distances.')
+        distances = load_distances(self.database)
         bad_walk, bad_bike, bad_transit, bad_vehicle, bad_maz = 0, 0, 0, 0, 0
         walk, bike, transit, vehicle = 0, 0, 0, 0
 
@@ -86,16 +41,8 @@ class Trips:
         for trip in self.get_trips():
             origin_maz, dest_maz, mode, duration = trip
             mode = Mode(mode)
-            key = frozenset((origin_maz, dest_maz))
-            
-            if origin_maz == dest_maz:
-                distance = 0
-            elif key in distances:
-                distance = distances[key]
-            elif origin_maz in regions and dest_maz in regions:
-                distance = regions[origin_maz].distance(regions[dest_maz]) * 0.3048
-                distances[key] = distance
-            else:
+            distance = distances.get(origin_maz, dest_maz)
+            if distance is None:
                 distance = 0
                 bad_maz += 1
 
@@ -1,6 +1,7 @@
 
 import os
 import logging as log
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import contextily as ctx
@@ -10,7 +11,8 @@ from collections import defaultdict
 from argparse import ArgumentParser
 from shapely.geometry import LineString
 
-from icarus.util.sqlite import SqliteUtil
+from icarus.util.sqlite import SqliteUtil, open_database
+from icarus.util.snapshot import load_snapshot
 from icarus.util.general import counter
 
 
@@ -23,10 +25,6 @@ class Link:
         self.profile = profile
 
 
-def xy(point: str) -> tuple:
-    return tuple(map(float, point[7:-1].split(' ')))
-
-
 def idx_to_hhmm(idx: int):
     hrs = idx // 4
     mins = 15 * (idx % 4) 
@@ -35,32 +33,28 @@ def idx_to_hhmm(idx: int):
 
 
 def load_links(database: SqliteUtil):
-    query = '''
-        SELECT
-            links.link_id,
-            links.mrt_temperature,
-            nodes1.point AS source_point,
-            nodes2.point AS terminal_point
-        FROM links
-        INNER JOIN nodes AS nodes1
-        ON links.source_node = nodes1.node_id
-        INNER JOIN nodes AS nodes2
-        ON links.terminal_node = nodes2.node_id;
-    '''
-    database.cursor.execute(query)
-    rows = database.fetch_rows()
+    network = load_snapshot(database)
+    src_x = network.node_x[network.link_source]
+    src_y = network.node_y[network.link_source]
+    term_x = network.node_x[network.link_terminal]
+    term_y = network.node_y[network.link_terminal]
+
+    inside = (np.minimum(src_x, term_x) > 0.5e6) & \
+        (np.maximum(src_x, term_x) < 0.85e6) & \
+        (np.minimum(src_y, term_y) > 0.8e6) & \
+        (np.maximum(src_y, term_y) < 1.0e6)
+    selected = np.flatnonzero(inside)
+    rows = zip(network.link_ids[selected].tolist(), 
+        network.link_mrt[selected].tolist(), src_x[selected].tolist(), 
+        src_y[selected].tolist(), term_x[selected].tolist(), 
+        term_y[selected].tolist())
     rows = counter(rows, 'Loading link %s.')
 
-    bounds = lambda x, y: min(x) > 0.5e6 and max(x) < 0.85e6 and \
-        min(y) > 0.8e6 and max(y) < 1.0e6
-
     links = []
-    for link_id, profile, src_pt, term_pt in rows:
-        line = LineString((xy(src_pt), xy(term_pt)))
-        x, y = line.coords.xy
-        if bounds(x, y):
-            link = Link(link_id, line, profile)
-            links.append(link)
+    for link_id, profile, x1, y1, x2, y2 in rows:
+        line = LineString(((x1, y1), (x2, y2)))
+        profile = None if profile < 0 else profile
+        links.append(Link(link_id, line, profile))
     
     return links
 
@@ -247,7 +241,7 @@ def main():
         handlers=handlers
     )
 
-    database = SqliteUtil('database.db', readonly=True)
+    database = open_database('.', 'temperature', readonly=True)
     kind = 'mrt'
 
     map_mrt_temperature(database, kind)